@@ -1,24 +1,68 @@
-import yfinance as yf
+import numpy as np
 import pandas as pd
-from scipy.signal import find_peaks
 from datetime import datetime, timedelta
-from myfxbook_scrapper import get_short_percentage
+from myfxbook_scrapper import get_short_percentages
+from indicator_engine import IndicatorEngine
+from bar_cache import BarCache, BASE_INTERVAL
+from signal_store import SignalStore, DATE_COLUMNS, format_signals, frame_signature, to_dates
+from quote_service import quotes
+from metrics import metrics
+from pair_table import load_pairs, pair_parameters, pair_tickers
+from shard_pool import ShardPool
+from market_hours import is_fx_open, market_closed_message
+from scheduler import Scheduler, settle_seconds
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import os
-import schedule
+import threading
 import time
 
-def get_price_peak_and_macd(ticker, start_date, end_date, interval, prominence, distance):
-    data = yf.download(ticker, start=start_date, end=end_date, interval=interval)
+state_file = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\state\macd_state.json"
+cache_directory = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\bars"
+engine = IndicatorEngine()
+cache = BarCache(cache_directory)
+export_csv = False
+max_workers = 16
+fetch_timeout = 60
 
-    close_prices = data['Close']
+intervals = ["15m", "60m", "90m"]
+lookback_days = [3, 10, 20]
 
-    ema_12 = close_prices.ewm(span=12, adjust=False).mean()
-    ema_26 = close_prices.ewm(span=26, adjust=False).mean()
-    macd_line = ema_12 - ema_26
-    signal_line = macd_line.ewm(span=9, adjust=False).mean()
-    macd_histogram = macd_line - signal_line
+# the pair universe and its prominence/distance come from pairs.csv, see pair_table
+pairs = load_pairs(intervals=intervals)
+parameters = pair_parameters(pairs, intervals)
+tickers = [ticker for ticker in pair_tickers(pairs) if ticker in parameters]
 
-    peaks, _ = find_peaks(close_prices, prominence=prominence, distance=distance)
+# with shards > 0 the pairs are split over that many worker processes instead of threads in this one
+shards = 0
+shard_pool = None
+
+# where make_df takes "now" from, replay.py swaps in its virtual clock
+clock = datetime.now
+
+# ticker -> (signature of its bars and parameters, peaks); a ticker whose bars did not change since the
+# last cycle reuses its peaks, and a signals frame equal to the last saved one is not saved again
+ticker_memo = {}
+last_saved_signature = None
+
+# tickers whose get_ticker_peaks is still running; a fetch that timed out keeps going in its thread, and a
+# second one on the same ticker would fold bars into the same indicator state at the same time
+in_flight = set()
+in_flight_lock = threading.Lock()
+
+
+def get_price_peak_and_macd(ticker, start_date, end_date, interval, prominence, distance, data=None):
+    if data is None:
+        fetch_start = engine.fetch_start(ticker, interval, start_date)
+        with metrics.timer('download', ticker=ticker, interval=interval):
+            data = cache.get(ticker, fetch_start, end_date, interval)
+
+    with metrics.timer('indicators', ticker=ticker, interval=interval):
+        engine.update(ticker, interval, data['Close'])
+    if len(data) > 0:
+        quotes.publish(ticker, data['Close'].iloc[-1])
+
+    with metrics.timer('peaks', ticker=ticker, interval=interval):
+        peaks = engine.recent_peaks(ticker, interval, prominence, distance, start_date)
 
     if len(peaks) > 0:
         most_recent_peak = peaks[-1]
@@ -26,75 +70,149 @@ def get_price_peak_and_macd(ticker, start_date, end_date, interval, prominence,
         return None, None
 
     peak_info = {
-        'Date': data.index[most_recent_peak],
-        'Price': close_prices.iloc[most_recent_peak],
-        'MACD': macd_histogram.iloc[most_recent_peak]
+        'Date': most_recent_peak[0],
+        'Price': most_recent_peak[1],
+        'MACD': most_recent_peak[2]
     }
 
+    recent = engine.recent(ticker, interval)
     most_recent = {
-        'Date': data.index[-1],
-        'Price': close_prices.iloc[-1],
-        'MACD': macd_histogram.iloc[-1]
+        'Date': recent[0],
+        'Price': recent[1],
+        'MACD': recent[2]
     }
 
     return peak_info, most_recent
 
 
-def make_df():
-    tickers = ["USDJPY=X", "EURUSD=X", "GBPUSD=X", "AUDUSD=X", "USDCAD=X"]
-    start_dates = [
-        (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d'),
-        (datetime.now() - timedelta(days=10)).strftime('%Y-%m-%d'),
-        (datetime.now() - timedelta(days=20)).strftime('%Y-%m-%d')
-    ]
-    intervals = ["15m", "60m", "90m"]
-
-    parameters = {
-        "USDJPY=X": {
-            "prominence": [0.1, 0.2, 0.6],
-            "distance": [3, 5, 16]
-        },
-        "EURUSD=X": {
-            "prominence": [0.0002, 0.0007, 0.002],
-            "distance": [3, 5, 16]
-        },
-        "GBPUSD=X": {
-            "prominence": [0.0004, 0.0007, 0.0007],
-            "distance": [3, 8, 16]
-        },
-        "AUDUSD=X": {
-            "prominence": [0.0001, 0.0007, 0.0007],
-            "distance": [3, 5, 16]
-        },
-        "USDCAD=X": {
-            "prominence": [0.0003, 0.0009, 0.0009],
-            "distance": [3, 5, 16]
-        },
-        "USDPLN=X": {
-            "prominence": [0.003, 0.007, 0.007],
-            "distance": [3, 5, 16]
-        }
-    }
+def get_ticker_peaks(ticker, start_dates, end_date, intervals, prominence, distance):
+    # every interval is resampled from one download of the base interval
+    fetch_starts = [engine.fetch_start(ticker, interval, start_date) for start_date, interval in zip(start_dates, intervals)]
+    with metrics.timer('download', ticker=ticker):
+        frames = cache.get_timeframes(ticker, fetch_starts, end_date, intervals)
+
+    # the engine only reads bars past its last closed one, so the last closed and the forming bar are all
+    # that can change its result (the window shrinks to them once the state is warm)
+    signature = (tuple(start_dates), tuple(prominence), tuple(distance),
+                 tuple(frame_signature(frames[interval][['High', 'Low', 'Close']].tail(2)) for interval in intervals))
+    memo = ticker_memo.get(ticker)
+    if memo is not None and memo[0] == signature:
+        metrics.count('peaks_unchanged', ticker=ticker.split('=')[0])
+        base = frames[intervals[0]]
+        if len(base) > 0:
+            quotes.publish(ticker, base['Close'].iloc[-1])
+        return memo[1]
+
+    peaks = {interval: get_price_peak_and_macd(ticker, start_dates[i], end_date, interval, prominence[i], distance[i],
+                                               frames[interval])
+             for i, interval in enumerate(intervals)}
+    ticker_memo[ticker] = (signature, peaks)
+    return peaks
+
+
+def collect(future, default, name, deadline):
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FuturesTimeoutError:
+        print(f"Timed out fetching {name}")
+    except Exception as e:
+        print(f"Error fetching {name}: {e}")
+    return default
+
+
+def release(ticker):
+    with in_flight_lock:
+        in_flight.discard(ticker)
+
+
+def fetch_peaks(tickers, start_dates, end_date, intervals, parameters, deadline):
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    with in_flight_lock:
+        busy = [ticker for ticker in tickers if ticker in in_flight]
+        in_flight.update(ticker for ticker in tickers if ticker not in busy)
+    for ticker in busy:
+        print(f"Still fetching {ticker} from an earlier cycle, skipping it")
+        metrics.count('fetch_in_flight', ticker=ticker)
+
+    peak_futures = {}
+    for ticker in tickers:
+        if ticker in busy:
+            continue
+        ticker_params = parameters.get(ticker, {})
+        prominence = ticker_params.get('prominence')
+        distance = ticker_params.get('distance')
+        future = executor.submit(metrics.carry(get_ticker_peaks), ticker, start_dates, end_date, intervals,
+                                 prominence, distance)
+        # done callbacks also run for futures cancelled before they started
+        future.add_done_callback(lambda _, ticker=ticker: release(ticker))
+        peak_futures[ticker] = future
+
+    peaks = {}
+    for ticker in tickers:
+        ticker_peaks = {}
+        if ticker in peak_futures:
+            ticker_peaks = collect(peak_futures[ticker], {}, f"{ticker} bars", deadline)
+        for interval in intervals:
+            peaks[(ticker, interval)] = ticker_peaks.get(interval, (None, None))
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    return peaks
+
+
+def get_shard_pool():
+    global shard_pool
+    if shard_pool is None:
+        shard_pool = ShardPool(shards, state_file)
+    return shard_pool
+
+
+def fetch_all(tickers, start_dates, end_date, intervals, parameters):
+    executor = ThreadPoolExecutor(max_workers=1)
+    short_future = executor.submit(metrics.carry(get_short_percentages), [ticker.split('=')[0] for ticker in tickers])
+
+    deadline = time.monotonic() + fetch_timeout
+
+    if shards > 0:
+        peaks = get_shard_pool().fetch_peaks(tickers, start_dates, end_date, intervals, parameters, deadline)
+        # the workers' quote publishes stay in their processes
+        for (ticker, interval), (peak_info, recent) in peaks.items():
+            if recent is not None:
+                quotes.publish(ticker, recent['Price'])
+        peaks = {(ticker, interval): peaks.get((ticker, interval), (None, None))
+                 for ticker in tickers for interval in intervals}
+    else:
+        peaks = fetch_peaks(tickers, start_dates, end_date, intervals, parameters, deadline)
+
+    short_percentages = collect(short_future, {}, "short percentages", deadline)
+    short_percentages = {ticker: short_percentages.get(ticker.split('=')[0]) for ticker in tickers}
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    return short_percentages, peaks
+
+def make_df(save=True):
+    global last_saved_signature
+    now = clock()
+    start_dates = [(now - timedelta(days=days)).strftime('%Y-%m-%d') for days in lookback_days]
+
+    end_date = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+    with metrics.timer('fetch_all'):
+        short_percentages, peaks = fetch_all(tickers, start_dates, end_date, intervals, parameters)
 
     results = []
 
     for ticker in tickers:
         ticker_name = ticker.split('=')[0]
-        short_percentage_list = get_short_percentage(ticker_name)
-        short_percentage = short_percentage_list[0] if short_percentage_list else None
+        short_percentage_list = short_percentages[ticker]
+        short_percentage = short_percentage_list[0] * 100 if short_percentage_list else np.nan
 
         for i in range(len(start_dates)):
-            start_date = start_dates[i]
             interval = intervals[i]
-            end_date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
-
-            ticker_params = parameters.get(ticker, {})
-            prominence = ticker_params.get('prominence')
-            distance = ticker_params.get('distance')
-            prominence_value = prominence[i]
-            distance_value = distance[i]
-
-            peak_info, recent = get_price_peak_and_macd(ticker, start_date, end_date, interval, prominence_value, distance_value)
+            peak_info, recent = peaks[(ticker, interval)]
+            metrics.latency('bar_to_signal', None if recent is None else recent['Date'], ticker=ticker_name,
+                            interval=interval)
 
             if peak_info is not None and recent is not None:
                 price_change = recent['Price'] - peak_info['Price']
@@ -104,52 +222,85 @@ def make_df():
                     'Ticker': ticker_name,
                     'Interval': interval,
                     'LAST PEAK DATE': peak_info['Date'],
-                    'LAST PEAK PRICE': f"{peak_info['Price']:.4f}",
-                    'LAST PEAK MACD': f"{peak_info['MACD']:.7f}",
+                    'LAST PEAK PRICE': peak_info['Price'],
+                    'LAST PEAK MACD': peak_info['MACD'],
                     'RECENT PRICE DATE': recent['Date'],
-                    'RECENT PRICE': f"{recent['Price']:.4f}",
-                    'RECENT MACD': f"{recent['MACD']:.7f}",
-                    'PRICE CHANGE': f"{price_change:.4f}",
-                    'PERCENTAGE CHANGE': f"{percentage_change:.2f}%",
-                    'SHORT %': f"{short_percentage * 100:.2f}%" if short_percentage is not None else 'N/A'
+                    'RECENT PRICE': recent['Price'],
+                    'RECENT MACD': recent['MACD'],
+                    'PRICE CHANGE': price_change,
+                    'PERCENTAGE CHANGE': percentage_change,
+                    'SHORT %': short_percentage
                 })
             else:
                 results.append({
                     'Ticker': ticker_name,
                     'Interval': interval,
-                    'LAST PEAK DATE': 'N/A',
-                    'LAST PEAK PRICE': 'N/A',
-                    'LAST PEAK MACD': 'N/A',
-                    'RECENT PRICE DATE': 'N/A' if recent is None else recent['Date'],
-                    'RECENT PRICE': 'N/A' if recent is None else f"{recent['Price']:.4f}",
-                    'RECENT MACD': 'N/A' if recent is None else f"{recent['MACD']:.7f}",
-                    'PRICE CHANGE': 'N/A',
-                    'PERCENTAGE CHANGE': 'N/A',
-                    'SHORT %': f"{short_percentage * 100:.2f}%" if short_percentage is not None else 'N/A'
+                    'LAST PEAK DATE': pd.NaT,
+                    'LAST PEAK PRICE': np.nan,
+                    'LAST PEAK MACD': np.nan,
+                    'RECENT PRICE DATE': pd.NaT if recent is None else recent['Date'],
+                    'RECENT PRICE': np.nan if recent is None else recent['Price'],
+                    'RECENT MACD': np.nan if recent is None else recent['MACD'],
+                    'PRICE CHANGE': np.nan,
+                    'PERCENTAGE CHANGE': np.nan,
+                    'SHORT %': short_percentage
                 })
 
+    # numbers stay float64 and dates datetime all the way to evaluation, format_signals gives the text layout
     df_results = pd.DataFrame(results)
+    for column in DATE_COLUMNS:
+        df_results[column] = to_dates(df_results[column])
 
-    output_dir = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\csvs"
-    os.makedirs(output_dir, exist_ok=True)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    csv_filename = f"signals_{timestamp}.csv"
-    csv_file_path = os.path.join(output_dir, csv_filename)
-    df_results.to_csv(csv_file_path, index=False)
+    if save:
+        signature = frame_signature(df_results)
+        if signature == last_saved_signature:
+            print("Signals unchanged since the last snapshot, not saving them again")
+        else:
+            save_signals(df_results)
+            last_saved_signature = signature
 
     return df_results
 
+def save_signals(df_results):
+    now = datetime.now()
+    with metrics.timer('store_write', kind='signals'), SignalStore() as store:
+        store.append('signals', df_results, now)
+
+    if export_csv:
+        output_dir = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\csvs"
+        os.makedirs(output_dir, exist_ok=True)
+        timestamp = now.strftime('%Y%m%d_%H%M%S')
+        csv_filename = f"signals_{timestamp}.csv"
+        csv_file_path = os.path.join(output_dir, csv_filename)
+        format_signals(df_results).to_csv(csv_file_path, index=False)
+
+def snapshot_state():
+    # sharded, the parent engine never sees a bar and each worker snapshots its own shard file after its
+    # fetch, so writing the parent's empty state would only wipe state_file for an unsharded restart
+    if shards > 0:
+        return
+    with metrics.timer('state_snapshot'):
+        engine.snapshot(state_file)
+
 def job():
+    if not is_fx_open():
+        print(market_closed_message())
+        return
+
     print(f"Starting signal retrieval at {datetime.now()}...")
 
-    df_results = make_df()
+    with metrics.cycle('signals'):
+        previous_signature = last_saved_signature
+        df_results = make_df()
+        # unchanged signals mean no new bars reached the indicator state either
+        if last_saved_signature != previous_signature:
+            snapshot_state()
 
     print(df_results)
-job()
 
-interval_minutes = 5
-schedule.every(interval_minutes).minutes.do(job)
+if __name__ == '__main__':
+    engine.restore(state_file)
+    job()
 
-while True:
-    schedule.run_pending()
-    time.sleep(1)
\ No newline at end of file
+    # every interval closes on a 15m close, so one run just after each 15m close sees them all
+    Scheduler().every(BASE_INTERVAL, job, settle_seconds, 'signals').run()
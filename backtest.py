@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from portfolio_manager import (initial_portfolio_value, starting_investment_per_ticker, take_profit, stop_loss,
+                               leverage, entry_threshold)
+from strategies import StrategyBook
+
+
+def evaluation_matrix(evals):
+    # per snapshot and ticker, the same aggregation update_portfolio does on the latest evals file:
+    # Evaluation of the first row, MACD-Price Evaluation summed over intervals, 15m RECENT PRICE as entry price
+    keys = ['Snapshot', 'Ticker']
+    tickers = list(pd.unique(evals['Ticker']))
+
+    first_rows = evals.drop_duplicates(keys).set_index(keys)
+    macd_price = evals['MACD-Price Evaluation']
+    macd_price_sum = macd_price.fillna(0).groupby([evals['Snapshot'], evals['Ticker']]).sum()
+    macd_price_sum[macd_price.isna().groupby([evals['Snapshot'], evals['Ticker']]).any()] = np.nan
+
+    total = (first_rows['Evaluation'] + macd_price_sum).unstack('Ticker').reindex(columns=tickers)
+
+    rows_15m = evals[evals['Interval'] == '15m'].drop_duplicates(keys).set_index(keys)
+    transaction_price = rows_15m['RECENT PRICE'].unstack('Ticker').reindex(index=total.index, columns=tickers)
+
+    return total.sort_index(), transaction_price.sort_index()
+
+
+def prices_from_signals(signals):
+    rows_15m = signals[signals['Interval'] == '15m']
+    prices = rows_15m.pivot_table(index='Snapshot', columns='Ticker', values='RECENT PRICE', aggfunc='last')
+    return prices.sort_index()
+
+
+def prices_from_cache(cache, tickers, start_date, end_date, interval='15m'):
+    closes = {ticker: cache.get(f"{ticker}=X", start_date, end_date, interval)['Close'] for ticker in tickers}
+    prices = pd.DataFrame(closes).sort_index()
+    if prices.index.tz is not None:
+        prices.index = prices.index.tz_convert(None)
+    return prices
+
+
+def strategy_ticks(evals, prices):
+    # the evaluation, entry price and current price matrices on every price tick from the first snapshot on
+    total, transaction_price = evaluation_matrix(evals)
+    tickers = list(total.columns)
+
+    ticks = prices.index[prices.index >= total.index[0]]
+    total = total.reindex(ticks, method='ffill').to_numpy(dtype='float64')
+    transaction_price = transaction_price.reindex(ticks, method='ffill').to_numpy(dtype='float64')
+    price_matrix = prices.reindex(columns=tickers).ffill().loc[ticks].to_numpy(dtype='float64')
+    return tickers, ticks, total, transaction_price, price_matrix
+
+
+def run_strategies(evals, prices, strategies, keep_equity=True):
+    # every row of strategies (see strategies.load_strategies) on the same evaluations and prices in one pass
+    tickers, ticks, total, transaction_price, price_matrix = strategy_ticks(evals, prices)
+    book = StrategyBook(strategies, keep_equity)
+    book.add_tickers(tickers)
+    for t, tick in enumerate(ticks):
+        book.step(tick, total[t], transaction_price[t], price_matrix[t])
+    return book
+
+
+def run_backtest(evals, prices, initial_value=initial_portfolio_value,
+                 investment=starting_investment_per_ticker, take_profit=take_profit, stop_loss=stop_loss,
+                 leverage=leverage, entry_threshold=entry_threshold):
+    strategy = pd.DataFrame([{'Name': 'backtest', 'Initial Value': initial_value, 'Investment': investment,
+                              'Entry Threshold': entry_threshold, 'Take Profit': take_profit,
+                              'Stop Loss': stop_loss, 'Leverage': leverage}])
+    book = run_strategies(evals, prices, strategy)
+
+    equity_df = pd.DataFrame()
+    if book.equity:
+        equity_df = pd.DataFrame({column: book.equity_frame(column)['backtest']
+                                  for column in ['Portfolio Value', 'Open Positions', 'Realized Gain/Loss']})
+
+    return book.history_frame('backtest'), equity_df, book.portfolio_frame('backtest')
+
+
+if __name__ == '__main__':
+    from signal_store import SignalStore
+
+    with SignalStore() as store:
+        evals = store.history('evals')
+        signals = store.history('signals')
+
+    if evals.empty or signals.empty:
+        print("No evaluations or signals in the store yet, nothing to backtest")
+        raise SystemExit
+
+    prices = prices_from_signals(signals)
+
+    history_df, equity_df, portfolio_df = run_backtest(evals, prices)
+
+    print("Transaction History DataFrame:")
+    print(history_df)
+    print("Portfolio DataFrame:")
+    print(portfolio_df)
+    if equity_df.empty:
+        print("No price ticks after the first evaluation, no portfolio value to report")
+    else:
+        print(f"Final Portfolio Value: ${equity_df['Portfolio Value'].iloc[-1]:.2f}")
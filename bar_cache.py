@@ -0,0 +1,182 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+AGGREGATION = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Adj Close': 'last', 'Volume': 'sum'}
+RESAMPLE_RULES = {'15m': '15min', '30m': '30min', '60m': '60min', '90m': '90min', '1h': '60min', '1d': '1D'}
+BASE_INTERVAL = '15m'
+
+OFFLINE = os.getenv("BAR_CACHE_OFFLINE") == "1"
+LOCAL_BARS_DIRECTORY = os.getenv("LOCAL_BARS_DIR")
+
+
+def normalize_bars(data):
+    if data is None or len(data) == 0:
+        return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], tz='UTC'), dtype='float64')
+
+    if isinstance(data.columns, pd.MultiIndex):
+        data = data.droplevel(1, axis=1)
+
+    data = data.reindex(columns=COLUMNS).astype('float64')
+    if data.index.tz is None:
+        data.index = data.index.tz_localize('UTC')
+    data = data[~data.index.duplicated(keep='last')].sort_index()
+    return data
+
+
+def resample_bars(data, interval):
+    # bars are labelled with their open time like yahoo's, and bins start at midnight in the timezone of the
+    # data, which is where yahoo starts the day's 60m/90m fx bars; bins without any base bar are dropped
+    if len(data) == 0:
+        return normalize_bars(None)
+    bars = data.resample(RESAMPLE_RULES[interval], origin='start_day', label='left', closed='left').agg(AGGREGATION)
+    return bars[bars['Close'].notna()]
+
+
+class YahooProvider:
+    def __init__(self, timeout=20):
+        self.timeout = timeout
+
+    def download(self, ticker, start_date, end_date, interval):
+        import yfinance as yf
+
+        # Ticker.history keeps no shared state, unlike yf.download, so it is safe to call from worker threads
+        data = yf.Ticker(ticker).history(start=start_date, end=end_date, interval=interval, auto_adjust=False,
+                                         timeout=self.timeout)
+        return normalize_bars(data)
+
+
+class LocalProvider:
+    # offline source: <directory>/<ticker>_<interval>.csv with a datetime index and OHLCV columns
+    def __init__(self, directory):
+        self.directory = directory
+
+    def download(self, ticker, start_date, end_date, interval):
+        path = os.path.join(self.directory, f"{ticker}_{interval}.csv")
+        if not os.path.exists(path):
+            print(f"No local bars for {ticker} {interval} at {path}")
+            return normalize_bars(None)
+
+        data = pd.read_csv(path, index_col=0, parse_dates=True)
+        data = normalize_bars(data)
+        return data[(data.index >= _localize(start_date, data.index)) & (data.index < _localize(end_date, data.index))]
+
+
+def _same_bars(cached, merged):
+    return (len(cached) == len(merged) and cached.index.equals(merged.index) and
+            np.array_equal(cached[COLUMNS].to_numpy(dtype='float64'), merged[COLUMNS].to_numpy(dtype='float64'),
+                           equal_nan=True))
+
+
+class BarCache:
+    def __init__(self, directory, provider=None):
+        self.directory = directory
+        self.provider = provider if provider is not None else default_provider()
+
+    def _path(self, ticker, interval):
+        return os.path.join(self.directory, ticker.replace('=', '_'), interval)
+
+    def load(self, ticker, interval):
+        path = self._path(ticker, interval)
+        meta_file = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_file):
+            return normalize_bars(None)
+
+        # read into memory rather than mapped, so store() can replace the files while a frame from here (or
+        # from another process) is still alive; a cache left half written is a miss and gets fetched again
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+            values = np.load(os.path.join(path, 'index.npy'))
+            columns = {column: np.load(os.path.join(path, f"{i}.npy")) for i, column in enumerate(COLUMNS)}
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Unreadable bar cache for {ticker} {interval}: {e}")
+            return normalize_bars(None)
+        if any(len(array) != meta['rows'] for array in [values] + list(columns.values())):
+            print(f"Bar cache for {ticker} {interval} does not match its meta.json, fetching it again")
+            return normalize_bars(None)
+
+        index = pd.to_datetime(values, unit='ns', utc=True).tz_convert(meta['tz'])
+        return pd.DataFrame(columns, index=index)
+
+    def store(self, ticker, interval, data):
+        path = self._path(ticker, interval)
+        os.makedirs(path, exist_ok=True)
+
+        # every file is written next to its final name and renamed, meta.json last, so a crash leaves either
+        # the old cache or one load() rejects
+        index = data.index
+        arrays = [('index.npy', index.tz_convert('UTC').as_unit('ns').asi8)]
+        arrays += [(f"{i}.npy", data[column].to_numpy(dtype='float64')) for i, column in enumerate(COLUMNS)]
+        for name, array in arrays:
+            with open(os.path.join(path, name + '.tmp'), 'wb') as f:
+                np.save(f, array)
+        with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+            json.dump({'tz': str(index.tz), 'rows': len(data)}, f)
+
+        for name in [name for name, _ in arrays] + ['meta.json']:
+            os.replace(os.path.join(path, name + '.tmp'), os.path.join(path, name))
+
+    def get(self, ticker, start_date, end_date, interval):
+        cached = self.load(ticker, interval)
+
+        if len(cached) == 0:
+            fetched = [self.provider.download(ticker, start_date, end_date, interval)]
+        else:
+            fetched = []
+            if _localize(start_date, cached.index) < cached.index[0]:
+                # the end date is exclusive and the cache may start mid-day, so the backfill runs through the
+                # first cached day and the overlap is dropped in the merge
+                backfill_end = (cached.index[0].normalize() + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+                fetched.append(self.provider.download(ticker, start_date, backfill_end, interval))
+            # the last stored bar may have been still forming, so it is always refetched
+            fetched.append(self.provider.download(ticker, cached.index[-1].strftime('%Y-%m-%d'), end_date, interval))
+
+        fetched = [data for data in fetched if len(data) > 0]
+        if fetched:
+            merged = pd.concat([cached] + fetched) if len(cached) > 0 else pd.concat(fetched)
+            merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+            # a closed market or a bar that has not moved refetches what is already stored
+            if not _same_bars(cached, merged):
+                self.store(ticker, interval, merged)
+            cached = merged
+
+        return _between(cached, start_date, end_date)
+
+    def get_timeframes(self, ticker, start_dates, end_date, intervals, base_interval=BASE_INTERVAL):
+        # one base interval series over the longest lookback, every other interval is resampled from it;
+        # the start dates are whole days, so the first bin of every interval is complete
+        base = self.get(ticker, min(start_dates, key=pd.Timestamp), end_date, base_interval)
+
+        frames = {}
+        for start_date, interval in zip(start_dates, intervals):
+            if interval == base_interval:
+                frames[interval] = _between(base, start_date, end_date)
+            else:
+                frames[interval] = resample_bars(_between(base, start_date, end_date), interval)
+        return frames
+
+
+def default_provider():
+    if OFFLINE:
+        return LocalProvider(LOCAL_BARS_DIRECTORY or '.')
+    return YahooProvider()
+
+
+def _between(data, start_date, end_date):
+    # positional slice, so the columns are not copied
+    if len(data) == 0:
+        return data
+    start = data.index.searchsorted(_localize(start_date, data.index))
+    end = data.index.searchsorted(_localize(end_date, data.index))
+    return data.iloc[start:end]
+
+
+def _localize(date, index):
+    date = pd.Timestamp(date)
+    if index.tz is not None and date.tz is None:
+        date = date.tz_localize(index.tz)
+    return date
@@ -0,0 +1,339 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+base_directory = os.path.dirname(os.path.abspath(__file__))
+results_file = os.path.join(base_directory, 'benchmarks', 'results.jsonl')
+repeats = 5
+regression_tolerance = 1.25
+baseline_runs = 5
+
+pair_sizes = [5, 20, 80]
+lookback_sizes = [1, 4, 16]
+evaluation_sizes = [100, 1000, 10000]
+portfolio_sizes = [1, 10, 50]
+
+freqs = {'15m': '15min', '60m': '60min', '90m': '90min'}
+
+
+class SyntheticProvider:
+    # deterministic random walk bars per ticker, the same bar always gets the same price so refetches
+    # line up with what is cached; nothing is downloaded
+    origin = pd.Timestamp('2024-01-01', tz='UTC')
+    walks = {}
+
+    def __init__(self, clock=None):
+        # bars stop at the clock (tz aware), the wall clock by default
+        self.clock = clock
+
+    def walk(self, ticker, interval, length):
+        walk = self.walks.get((ticker, interval))
+        if walk is None or len(walk) < length:
+            rng = np.random.default_rng(zlib.crc32(f"{ticker}{interval}".encode()))
+            walk = 1.1 * np.exp(np.cumsum(rng.normal(0, 0.001, length + 10000)))
+            self.walks[(ticker, interval)] = walk
+        return walk
+
+    def download(self, ticker, start_date, end_date, interval):
+        from bar_cache import normalize_bars
+
+        freq = pd.Timedelta(freqs[interval])
+        now = self.clock() if self.clock is not None else pd.Timestamp.now(tz='UTC')
+        end = min(pd.Timestamp(end_date, tz='UTC'), now.floor(freq))
+        index = pd.date_range(pd.Timestamp(start_date, tz='UTC'), end, freq=freq, inclusive='left')
+        positions = ((index - self.origin) // freq).to_numpy()
+        close = self.walk(ticker, interval, int(positions.max()) + 1 if len(positions) else 0)[positions]
+        data = pd.DataFrame({'Open': close, 'High': close * 1.0005, 'Low': close * 0.9995, 'Close': close,
+                             'Adj Close': close, 'Volume': 0.0}, index=index)
+        return normalize_bars(data)
+
+
+class SyntheticSentimentSource:
+    # overview page in the myfxbook layout listing every requested pair
+    def __init__(self, symbols):
+        self.symbols = symbols
+
+    def page(self, symbol=None):
+        symbols = self.symbols if symbol is None else [symbol]
+        rows = [f'<tr><td><a href="/community/outlook/{s}">{s}</a></td><td><table><tr><td>Short</td>'
+                f'<td>{self.short(s)}%</td></tr></table></td></tr>' for s in symbols]
+        return '<table>' + ''.join(rows) + '</table>'
+
+    def short(self, symbol):
+        return 40 + zlib.crc32(symbol.encode()) % 20
+
+
+@contextlib.contextmanager
+def patched(module, **values):
+    previous = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(module, name, value)
+
+
+def measure(run, setup=None, repeats=repeats):
+    # setup runs before every repeat and is not timed; whatever it returns is passed to run
+    timings = []
+    for _ in range(repeats):
+        argument = setup() if setup is not None else None
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run(argument) if setup is not None else run()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def synthetic_pairs(count):
+    import MACD_calculator
+    from myfxbook_scrapper import SentimentProvider
+
+    tickers = [f"SYN{i:03d}=X" for i in range(count)]
+    parameters = {ticker: {'prominence': [0.0004, 0.0008, 0.0015], 'distance': [3, 5, 16]} for ticker in tickers}
+    sentiment = SentimentProvider(SyntheticSentimentSource([ticker.split('=')[0] for ticker in tickers]), ttl=0)
+    return patched(MACD_calculator, tickers=tickers, parameters=parameters, get_short_percentages=sentiment.get_many)
+
+
+def bench_signals(quick=False):
+    # make_df over synthetic pairs: cold is an empty bar cache, indicator state and peak memo, warm is the next
+    # cycle (bars that have not moved reuse their peaks)
+    import MACD_calculator
+    from bar_cache import BarCache
+    from indicator_engine import IndicatorEngine
+
+    results = []
+    for pairs in pair_sizes[:2] if quick else pair_sizes:
+        with synthetic_pairs(pairs), tempfile.TemporaryDirectory() as directory:
+            def cold():
+                shutil.rmtree(directory, ignore_errors=True)
+                return BarCache(directory, SyntheticProvider()), IndicatorEngine(), {}
+
+            def run(state):
+                with patched(MACD_calculator, cache=state[0], engine=state[1], ticker_memo=state[2]):
+                    MACD_calculator.make_df(save=False)
+
+            results.append(('make_df cold', f"{pairs} pairs", measure(run, cold)))
+
+            warm = cold()
+            run(warm)
+            results.append(('make_df warm', f"{pairs} pairs", measure(lambda: run(warm))))
+    return results
+
+
+def bench_peaks(quick=False):
+    # one ticker/interval with lookbacks growing from 3 days of 15m bars upwards
+    import MACD_calculator
+    from bar_cache import BarCache
+    from indicator_engine import IndicatorEngine
+
+    end_date = (datetime.now() + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    results = []
+    for size in lookback_sizes[:2] if quick else lookback_sizes:
+        start_date = (datetime.now() - pd.Timedelta(days=3 * size)).strftime('%Y-%m-%d')
+        with tempfile.TemporaryDirectory() as directory:
+            cache = BarCache(directory, SyntheticProvider())
+            cache.get('SYN000=X', start_date, end_date, '15m')
+
+            def run(engine):
+                with patched(MACD_calculator, cache=cache, engine=engine):
+                    MACD_calculator.get_price_peak_and_macd('SYN000=X', start_date, end_date, '15m', 0.0004, 3)
+
+            bars = len(cache.load('SYN000=X', '15m'))
+            results.append(('get_price_peak_and_macd cold', f"{bars} bars", measure(run, IndicatorEngine)))
+
+            engine = IndicatorEngine()
+            run(engine)
+            results.append(('get_price_peak_and_macd warm', f"{bars} bars", measure(lambda: run(engine))))
+    return results
+
+
+def signal_fixtures(rows):
+    # the most recent signal csvs from csvs/, repeated with renamed tickers when there are not enough rows
+    directory = os.path.join(base_directory, 'csvs')
+    files = sorted(f for f in os.listdir(directory) if f.endswith('.csv'))
+    frames = []
+    count = 0
+    for f in reversed(files):
+        frame = pd.read_csv(os.path.join(directory, f))
+        frames.append(frame)
+        count += len(frame)
+        if count >= rows:
+            break
+    signals = pd.concat(frames, ignore_index=True)
+    copies = -(-rows // len(signals))
+    if copies > 1:
+        signals = pd.concat([signals.assign(Ticker=signals['Ticker'] + ('' if i == 0 else f"_{i}"))
+                             for i in range(copies)], ignore_index=True)
+    return signals.head(rows)
+
+
+def bench_evaluation(quick=False):
+    from evaluation import evaluate_short_percentage, evaluate_macd_price_correlation
+
+    results = []
+    for rows in evaluation_sizes[:2] if quick else evaluation_sizes:
+        signals = signal_fixtures(rows)
+        results.append(('evaluate_short_percentage', f"{rows} rows",
+                        measure(evaluate_short_percentage, lambda: signals.copy())))
+        scored = evaluate_short_percentage(signals.copy())
+        results.append(('evaluate_macd_price_correlation', f"{rows} rows",
+                        measure(evaluate_macd_price_correlation, lambda: scored.copy())))
+    return results
+
+
+def evaluation_fixture(copies):
+    directory = os.path.join(base_directory, 'evals')
+    latest = max(f for f in os.listdir(directory) if f.endswith('.csv'))
+    evaluation = pd.read_csv(os.path.join(directory, latest))
+    return pd.concat([evaluation.assign(Ticker=evaluation['Ticker'] + ('' if i == 0 else f"_{i}"))
+                      for i in range(copies)], ignore_index=True)
+
+
+def bench_portfolio(quick=False):
+    # update_portfolio on a copy of portfel/ and history/, prices come from the evaluation and
+    # notifications go to a local stub
+    import portfolio_manager
+    from notifier import StubTelegramServer, TelegramNotifier
+    from quote_service import QuoteService
+
+    class NoProvider:
+        def fetch(self, symbols):
+            return {}
+
+    results = []
+    with StubTelegramServer() as stub, tempfile.TemporaryDirectory() as directory:
+        notifier = TelegramNotifier(stub.url, 'benchmark', coalesce_window=0, min_interval=0)
+        for copies in portfolio_sizes[:2] if quick else portfolio_sizes:
+            evaluation = evaluation_fixture(copies)
+            portfolio_file = os.path.join(directory, 'portfolio.csv')
+            history_file = os.path.join(directory, 'transaction_history.csv')
+            journal_file = os.path.join(directory, 'journal.jsonl')
+            quotes = QuoteService(ttl=float('inf'), provider=NoProvider())
+            for ticker, price in evaluation.groupby('Ticker')['RECENT PRICE'].last().items():
+                quotes.publish(f"{ticker}=X", price)
+
+            def setup():
+                for path in [portfolio_file, history_file, journal_file]:
+                    if os.path.exists(path):
+                        os.remove(path)
+                shutil.copy(os.path.join(base_directory, 'portfel', 'portfolio.csv'), portfolio_file)
+                shutil.copy(os.path.join(base_directory, 'history', 'transaction_history.csv'), history_file)
+                shutil.rmtree(strategies_directory, ignore_errors=True)
+                portfolio_manager.state = None
+                portfolio_manager.strategies_book = None
+                portfolio_manager.get_state()
+                return evaluation.copy()
+
+            strategies_directory = os.path.join(directory, 'strategies')
+            with patched(portfolio_manager, portfolio_file=portfolio_file, history_file=history_file,
+                         journal_file=journal_file, notifier=notifier, state=None, quotes=quotes,
+                         strategies_book=None, strategies_directory=strategies_directory):
+                results.append(('update_portfolio', f"{evaluation['Ticker'].nunique()} pairs",
+                                measure(portfolio_manager.update_portfolio, setup)))
+            notifier.flush(10)
+    return results
+
+
+benchmarks = {
+    'signals': bench_signals,
+    'peaks': bench_peaks,
+    'evaluation': bench_evaluation,
+    'portfolio': bench_portfolio
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=base_directory, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path=results_file):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(results, previous, tolerance=regression_tolerance):
+    # the baseline is the median of the last few recorded medians for the same benchmark and size
+    rows = []
+    for name, size, timings in results:
+        median = statistics.median(timings)
+        history = [r['median'] for r in previous if r['benchmark'] == name and r['size'] == size][-baseline_runs:]
+        baseline = statistics.median(history) if history else None
+        rows.append({
+            'benchmark': name,
+            'size': size,
+            'median': median,
+            'min': min(timings),
+            'baseline': baseline,
+            'ratio': None if baseline is None else median / baseline,
+            'regression': baseline is not None and median > baseline * tolerance
+        })
+    return rows
+
+
+def record(rows, path=results_file):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    commit = git_commit()
+    with open(path, 'a') as f:
+        for row in rows:
+            f.write(json.dumps({'timestamp': timestamp, 'commit': commit, 'benchmark': row['benchmark'],
+                                'size': row['size'], 'median': row['median'], 'min': row['min'],
+                                'repeats': repeats}) + '\n')
+
+
+def run(names=None, quick=False, save=True):
+    from metrics import metrics
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory, patched(metrics, directory=directory, profile=False):
+        for name, bench in benchmarks.items():
+            if names and name not in names:
+                continue
+            print(f"Running {name} benchmarks...")
+            results.extend(bench(quick))
+
+    rows = compare(results, load_results())
+    if save:
+        record(rows)
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the signal, evaluation and portfolio hot paths offline')
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run out of {', '.join(benchmarks)}, all by default")
+    parser.add_argument('--quick', action='store_true', help='only the smaller sizes')
+    parser.add_argument('--no-record', action='store_true', help=f'do not append the results to {results_file}')
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in benchmarks]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    report = run(args.names, args.quick, not args.no_record)
+    print(report.to_string(index=False))
+
+    regressions = report[report['regression']]
+    if len(regressions) > 0:
+        print(f"Regressions (more than {regression_tolerance:.2f}x the baseline):")
+        print(regressions[['benchmark', 'size', 'median', 'baseline', 'ratio']].to_string(index=False))
+        raise SystemExit(1)
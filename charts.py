@@ -0,0 +1,181 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from bar_cache import BarCache
+from indicator_engine import IndicatorEngine
+from pair_table import INTERVALS, load_pairs, pair_parameters, pair_tickers
+
+state_file = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\state\macd_state.json"
+cache_directory = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\bars"
+charts_directory = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\charts"
+
+# days shown per interval in batch mode (the signal lookbacks) and the most candles drawn per chart
+chart_days = {'15m': 3, '60m': 10, '90m': 20}
+max_points = 500
+peaks_shown = 4
+
+# one engine per process, restored from the signal job's snapshot (and its shard snapshots) on first use
+engine = None
+
+
+def get_engine():
+    global engine
+    if engine is None:
+        engine = IndicatorEngine()
+        for path in [state_file] + sorted(glob.glob(glob.escape(state_file) + '.shard*')):
+            engine.restore(path)
+    return engine
+
+
+def lttb(values, threshold):
+    # largest triangle three buckets: indices of threshold points that keep the shape of the series, the
+    # first and last point always among them
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype='float64')
+    y = np.asarray(values, dtype='float64')
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        area = np.abs((x[a] - average_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (average_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def downsample(bars, indicators, peak_dates, threshold=max_points):
+    # the bars lttb keeps on the close, plus the peaks; each one is drawn as a candle over the bars since the
+    # previous kept one (first open, highest high, lowest low) so no wick disappears
+    if len(bars) <= threshold:
+        return bars, indicators
+
+    keep = lttb(bars['Close'].to_numpy(), threshold)
+    peak_positions = bars.index.get_indexer(peak_dates)
+    keep = np.union1d(keep, peak_positions[peak_positions >= 0])
+    starts = np.r_[0, keep[:-1] + 1]
+
+    sampled = pd.DataFrame({
+        'Open': bars['Open'].to_numpy()[starts],
+        'High': np.maximum.reduceat(bars['High'].to_numpy(), starts),
+        'Low': np.minimum.reduceat(bars['Low'].to_numpy(), starts),
+        'Close': bars['Close'].to_numpy()[keep],
+        'Volume': np.add.reduceat(bars['Volume'].fillna(0).to_numpy(), starts)
+    }, index=bars.index[keep])
+    return sampled, indicators.iloc[keep]
+
+
+def chart_data(ticker, interval, start_date, end_date, prominence, distance, cache=None):
+    # bars and the MACD line/signal/histogram over them; the restored engine state is brought up to date
+    # with only the bars it has not seen, and a fresh engine runs over the bars when the state does not
+    # reach back to start_date
+    cache = cache if cache is not None else BarCache(cache_directory)
+    bars = cache.get_timeframes(ticker, [start_date], end_date, [interval])[interval]
+    if len(bars) == 0:
+        return bars, None, []
+
+    engine = get_engine()
+    engine.update(ticker, interval, bars['Close'])
+    window = engine.window(ticker, interval).reindex(bars.index)
+    if window['MACD Line'].isna().any():
+        engine = IndicatorEngine(max_bars=len(bars) + 1)
+        engine.update(ticker, interval, bars['Close'])
+        window = engine.window(ticker, interval).reindex(bars.index)
+
+    indicators = pd.DataFrame({'MACD Line': window['MACD Line'], 'Signal': window['MACD Line'] - window['MACD'],
+                               'Histogram': window['MACD']}, index=bars.index)
+    peaks = engine.recent_peaks(ticker, interval, prominence, distance, start_date, n=peaks_shown)
+    return bars, indicators, [peak[0] for peak in peaks]
+
+
+def plot_chart(bars, indicators, peak_dates, title, path=None, threshold=max_points):
+    import matplotlib
+    if path is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import mplfinance as mpf
+
+    downsampled = len(bars) > threshold
+    bars, indicators = downsample(bars, indicators, peak_dates, threshold)
+
+    options = dict(
+        type='candle',
+        style='yahoo',
+        title=title,
+        ylabel='Exchange Rate',
+        volume=True,
+        figratio=(14, 7),
+        datetime_format='%b %d, %H:%M',
+        xrotation=45,
+        addplot=[
+            mpf.make_addplot(indicators['MACD Line'], panel=1, color='blue', secondary_y=False, label='MACD Line'),
+            mpf.make_addplot(indicators['Signal'], panel=1, color='orange', secondary_y=False, label='Signal Line'),
+            mpf.make_addplot(indicators['Histogram'], panel=1, type='bar', color='dimgray', secondary_y=True,
+                             label='Histogram')
+        ]
+    )
+    # moving averages over downsampled candles would average uneven spans
+    if not downsampled:
+        options['mav'] = (12, 26)
+    if peak_dates:
+        options['vlines'] = dict(vlines=list(peak_dates), linewidths=1, colors='red', alpha=0.7)
+
+    if path is None:
+        mpf.plot(bars, **options)
+    else:
+        mpf.plot(bars, savefig=dict(fname=path, dpi=100), **options)
+        plt.close('all')
+
+
+def render_ticker(ticker, intervals, days, prominence, distance, directory, threshold=max_points):
+    # every interval of one ticker in one process, so its bar cache files have a single writer
+    end_date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    cache = BarCache(cache_directory)
+    paths = []
+    for i, interval in enumerate(intervals):
+        start_date = (datetime.now() - timedelta(days=days[interval])).strftime('%Y-%m-%d')
+        bars, indicators, peak_dates = chart_data(ticker, interval, start_date, end_date, prominence[i],
+                                                  distance[i], cache)
+        if len(bars) == 0:
+            print(f"No bars for {ticker} {interval}")
+            continue
+        path = os.path.join(directory, f"{ticker.split('=')[0]}_{interval}.png")
+        plot_chart(bars, indicators, peak_dates, f"{ticker} {interval} MACD (last {days[interval]:g} days)", path,
+                   threshold)
+        paths.append(path)
+    return paths
+
+
+def render_all(tickers=None, intervals=INTERVALS, directory=charts_directory, days=None, workers=None,
+               threshold=max_points):
+    # <directory>/<ticker>_<interval>.png for every enabled pair, one process per ticker at a time
+    table = load_pairs(intervals=intervals)
+    parameters = pair_parameters(table, intervals)
+    tickers = tickers or [ticker for ticker in pair_tickers(table) if ticker in parameters]
+    days = {interval: days or chart_days.get(interval, chart_days['15m']) for interval in intervals}
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_ticker, ticker, intervals, days, parameters[ticker]['prominence'],
+                                   parameters[ticker]['distance'], directory, threshold): ticker
+                   for ticker in tickers if ticker in parameters}
+        for future in as_completed(futures):
+            try:
+                paths.extend(future.result())
+            except Exception as e:
+                print(f"Error rendering {futures[future]}: {e}")
+    return sorted(paths)
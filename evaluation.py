@@ -1,104 +1,97 @@
+import numpy as np
 import pandas as pd
 
+from pair_table import load_pairs, pair_thresholds
+
 def evaluate_short_percentage(df):
-    df['SHORT %'] = df['SHORT %'].astype(str).str.strip()
+    if not pd.api.types.is_numeric_dtype(df['SHORT %']):
+        df['SHORT %'] = df['SHORT %'].astype(str).str.strip()
 
-    df['SHORT %'] = df['SHORT %'].replace({'N/A': None, '%': ''}, regex=True).astype(float)
+        df['SHORT %'] = df['SHORT %'].replace({'N/A': None, '%': ''}, regex=True).astype(float)
 
-    df['Evaluation'] = df['SHORT %'].apply(lambda x: (x - 50) if pd.notnull(x) else None)
+    df['Evaluation'] = df['SHORT %'] - 50
 
     return df
 
 
-def evaluate_macd_price_correlation(df):
-    df['LAST PEAK PRICE'] = pd.to_numeric(df['LAST PEAK PRICE'], errors='coerce')
-    df['RECENT PRICE'] = pd.to_numeric(df['RECENT PRICE'], errors='coerce')
-    df['LAST PEAK MACD'] = pd.to_numeric(df['LAST PEAK MACD'], errors='coerce')
-    df['RECENT MACD'] = pd.to_numeric(df['RECENT MACD'], errors='coerce')
-
-    interval_scoring = {
-        '15m': (-10, 10),
-        '60m': (-14, 14),
-        '90m': (-11, 11)
-    }
-
-
-    thresholds = {
-        'USDCAD': {'price': {'15m': 0.0008, '60m': 0.0022, '90m': 0.0026},
-                   'macd': {'15m': 0.00012, '60m': 0.00019, '90m': 0.0003}},
-        'AUDUSD': {'price': {'15m': 0.002, '60m': 0.0024, '90m': 0.0026},
-                   'macd': {'15m': 0.0001, '60m': 0.00022, '90m': 0.00025}},
-        'GBPUSD': {'price': {'15m': 0.002, '60m': 0.002, '90m': 0.0023},
-                   'macd': {'15m': 0.0002, '60m': 0.00027, '90m': 0.0003}},
-        'EURUSD': {'price': {'15m': 0.001, '60m': 0.0023, '90m': 0.003},
-                   'macd': {'15m': 0.00006, '60m': 0.00025, '90m': 0.0003}},
-        'USDJPY': {'price': {'15m': 0.002, '60m': 0.004, '90m': 0.006},
-                   'macd': {'15m': 0.03, '60m': 0.085, '90m': 0.11}},
-        'USDPLN': {'price': {'15m': 0.0007, '60m': 0.003, '90m': 0.006},
-                   'macd': {'15m': 0.00040, '60m': 0.0007, '90m': 0.00082}},
-                   }
-
-    def evaluate(row):
-        if pd.isna(row['LAST PEAK PRICE']) or pd.isna(row['RECENT PRICE']) or pd.isna(row['LAST PEAK MACD']) or pd.isna(
-                row['RECENT MACD']):
-            return None
-
-        price_diff = row['RECENT PRICE'] - row['LAST PEAK PRICE']
-        macd_diff = row['RECENT MACD'] - row['LAST PEAK MACD']
-        if row['RECENT MACD'] <= 0:
-            if row['RECENT MACD'] <= row['LAST PEAK MACD']:
-                macd_movement = -1
-            else:
-                macd_movement = 1
-        else:
-            if row['RECENT MACD'] > row['LAST PEAK MACD']:
-                macd_movement = 1
-            else:
-                macd_movement = -1
-        if row['LAST PEAK PRICE'] != 0:
-            price_percentage_change = (price_diff / row['LAST PEAK PRICE']) * 100
-        else:
-            price_percentage_change = 0
-
-        abs_macd_diff = abs(macd_diff)
-
-        interval = row.get('Interval', '15m')
-        ticker = row.get('Ticker', 'USDJPY')
-
-        ticker_thresholds = thresholds.get(ticker, {})
-        price_threshold = ticker_thresholds.get('price', {}).get(interval, 0.0001)
-        macd_threshold = ticker_thresholds.get('macd', {}).get(interval, 0.1)
-
-        min_points, max_points = interval_scoring.get(interval, (0, 0))
-
-        if price_threshold > 0:
-            price_checkpoints = abs(price_percentage_change) // (price_threshold * 100)
-        else:
-            price_checkpoints = 0
-
-        if macd_threshold > 0:
-            macd_checkpoints = abs_macd_diff // macd_threshold
-        else:
-            macd_checkpoints = 0
-
-        if price_percentage_change > 0:
-            price_score = price_checkpoints * min_points
-        else:
-            price_score = price_checkpoints * max_points
-
-        if macd_movement > 0:
-            macd_score = macd_checkpoints * max_points
-        else:
-            macd_score = macd_checkpoints * min_points
-
-        total_score = price_score + macd_score
-
-        return total_score
-
-    df['MACD-Price Evaluation'] = df.apply(evaluate, axis=1)
+interval_scoring = {
+    '15m': (-10, 10),
+    '60m': (-14, 14),
+    '90m': (-11, 11)
+}
+
+
+thresholds = pair_thresholds(load_pairs())
+
+default_price_threshold = 0.0001
+default_macd_threshold = 0.1
+
+
+def build_tables(thresholds, interval_scoring):
+    # the extra last row/column holds the defaults, so unknown tickers/intervals (code -1) land there
+    tickers = list(thresholds)
+    intervals = list(interval_scoring)
+
+    price_table = np.full((len(tickers) + 1, len(intervals) + 1), default_price_threshold)
+    macd_table = np.full((len(tickers) + 1, len(intervals) + 1), default_macd_threshold)
+    for i, ticker in enumerate(tickers):
+        for j, interval in enumerate(intervals):
+            price_table[i, j] = thresholds[ticker].get('price', {}).get(interval, default_price_threshold)
+            macd_table[i, j] = thresholds[ticker].get('macd', {}).get(interval, default_macd_threshold)
+
+    scoring_table = np.zeros((len(intervals) + 1, 2))
+    for j, interval in enumerate(intervals):
+        scoring_table[j] = interval_scoring[interval]
+
+    return tickers, intervals, price_table, macd_table, scoring_table
+
+
+tables = build_tables(thresholds, interval_scoring)
+
+
+def evaluate_macd_price_correlation(df, tables=tables):
+    for column in ['LAST PEAK PRICE', 'RECENT PRICE', 'LAST PEAK MACD', 'RECENT MACD']:
+        if not pd.api.types.is_float_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+
+    tickers, intervals, price_table, macd_table, scoring_table = tables
+
+    last_peak_price = df['LAST PEAK PRICE'].to_numpy(dtype='float64')
+    recent_price = df['RECENT PRICE'].to_numpy(dtype='float64')
+    last_peak_macd = df['LAST PEAK MACD'].to_numpy(dtype='float64')
+    recent_macd = df['RECENT MACD'].to_numpy(dtype='float64')
+
+    ticker_column = df['Ticker'] if 'Ticker' in df else pd.Series('USDJPY', index=df.index)
+    interval_column = df['Interval'] if 'Interval' in df else pd.Series('15m', index=df.index)
+    ticker_codes = pd.Categorical(ticker_column, categories=tickers).codes
+    interval_codes = pd.Categorical(interval_column, categories=intervals).codes
+
+    price_threshold = price_table[ticker_codes, interval_codes]
+    macd_threshold = macd_table[ticker_codes, interval_codes]
+    min_points = scoring_table[interval_codes, 0]
+    max_points = scoring_table[interval_codes, 1]
+
+    df['MACD-Price Evaluation'] = score_macd_price(last_peak_price, recent_price, last_peak_macd, recent_macd,
+                                                   price_threshold, macd_threshold, min_points, max_points)
 
     return df
 
 
+def score_macd_price(last_peak_price, recent_price, last_peak_macd, recent_macd,
+                     price_threshold, macd_threshold, min_points, max_points):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price_percentage_change = np.where(last_peak_price != 0,
+                                           (recent_price - last_peak_price) / last_peak_price * 100, 0.0)
+
+        price_checkpoints = np.where(price_threshold > 0,
+                                     np.floor_divide(np.abs(price_percentage_change), price_threshold * 100), 0.0)
+        macd_checkpoints = np.where(macd_threshold > 0,
+                                    np.floor_divide(np.abs(recent_macd - last_peak_macd), macd_threshold), 0.0)
+
+    price_score = price_checkpoints * np.where(price_percentage_change > 0, min_points, max_points)
+    macd_score = macd_checkpoints * np.where(recent_macd > last_peak_macd, max_points, min_points)
 
+    total_score = price_score + macd_score
+    missing = np.isnan(last_peak_price) | np.isnan(recent_price) | np.isnan(last_peak_macd) | np.isnan(recent_macd)
 
+    return np.where(missing, np.nan, total_score)
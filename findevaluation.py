@@ -1,9 +1,15 @@
 import os
 from evaluation import evaluate_short_percentage, evaluate_macd_price_correlation
+from signal_store import SignalStore, format_signals
+from metrics import metrics
+from market_hours import is_fx_open, market_closed_message
+from scheduler import Scheduler, settle_seconds
 import pandas as pd
 from datetime import datetime
-import schedule
-import time
+
+export_csv = False
+# timestamp of the signals snapshot scored last, the same snapshot is not scored twice
+last_evaluated = None
 
 def read_most_recent_csv(directory):
     files = [f for f in os.listdir(directory) if f.endswith('.csv')]
@@ -19,30 +25,54 @@ def read_most_recent_csv(directory):
 
     return df
 
-def job():
-
-    directory = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\csvs"
+def evaluate(df):
+    with metrics.timer('evaluation'):
+        evaluated_df = evaluate_short_percentage(df)
 
-    recent_df = read_most_recent_csv(directory)
+        evaluated_df = evaluate_macd_price_correlation(evaluated_df)
+        evaluated_df['EVALUATION'] = evaluated_df['Evaluation'] + evaluated_df['MACD-Price Evaluation']
+    #evaluated_df = evaluated_df.drop(['Evaluation', 'MACD-Price Evaluation'], axis=1)
+    return evaluated_df
 
-    evaluated_df = evaluate_short_percentage(recent_df)
+def is_actionable(evaluated_df):
+    return (abs(evaluated_df['EVALUATION']) >= 30).any()
 
-    evaluated_df = evaluate_macd_price_correlation(evaluated_df)
-    evaluated_df['EVALUATION'] = evaluated_df['Evaluation'] + evaluated_df['MACD-Price Evaluation']
-    #evaluated_df = evaluated_df.drop(['Evaluation', 'MACD-Price Evaluation'], axis=1)
-    print(evaluated_df)
+def save_evaluation(evaluated_df):
+    now = datetime.now()
+    with metrics.timer('store_write', kind='evals'), SignalStore() as store:
+        store.append('evals', evaluated_df, now)
 
-    if (abs(evaluated_df['EVALUATION']) >= 30).any():
+    if export_csv:
         output_dir = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\evals"
         os.makedirs(output_dir, exist_ok=True)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        timestamp = now.strftime('%Y%m%d_%H%M%S')
         csv_filename = f"signals_{timestamp}.csv"
         csv_file_path = os.path.join(output_dir, csv_filename)
-        evaluated_df.to_csv(csv_file_path, index=False)
+        format_signals(evaluated_df).to_csv(csv_file_path, index=False)
+
+def job():
+    global last_evaluated
+    if not is_fx_open():
+        print(market_closed_message())
+        return
+
+    with SignalStore() as store:
+        latest = store.latest_timestamp('signals')
+        if latest is not None and latest == last_evaluated:
+            print(f"No signals since {latest}, nothing to evaluate")
+            return
+        recent_df = store.latest('signals')
+
+    with metrics.cycle('evaluation'):
+        last_evaluated = latest
+
+        evaluated_df = evaluate(recent_df)
+        print(evaluated_df)
 
-job()
-schedule.every(5).minutes.do(job)
+        if is_actionable(evaluated_df):
+            save_evaluation(evaluated_df)
 
-while True:
-    schedule.run_pending()
-    time.sleep(1)
\ No newline at end of file
+if __name__ == '__main__':
+    job()
+    # a minute after the signals of the same bar close
+    Scheduler().every('15m', job, settle_seconds + 60, 'evaluation').run()
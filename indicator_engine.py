@@ -0,0 +1,204 @@
+import bisect
+import json
+import os
+from collections import deque
+
+import pandas as pd
+
+from peak_tracker import PeakTracker
+
+FAST_SPAN = 12
+SLOW_SPAN = 26
+SIGNAL_SPAN = 9
+MAX_BARS = 1000
+
+
+def _alpha(span):
+    return 2.0 / (span + 1.0)
+
+
+class MACDState:
+    def __init__(self, max_bars=MAX_BARS):
+        self.ema_fast = None
+        self.ema_slow = None
+        self.signal = None
+        self.last_closed = None
+        self.count = 0
+        self.forming = None
+        self.max_bars = max_bars
+        self.dates = deque(maxlen=max_bars)
+        self.closes = deque(maxlen=max_bars)
+        self.histogram = deque(maxlen=max_bars)
+        self.macd = deque(maxlen=max_bars)
+        self.trackers = {}
+
+    def step(self, close):
+        # same recursion as ewm(span=..., adjust=False): seeded with the first value
+        if self.ema_fast is None:
+            return close, close, 0.0, 0.0
+
+        ema_fast = self.ema_fast + _alpha(FAST_SPAN) * (close - self.ema_fast)
+        ema_slow = self.ema_slow + _alpha(SLOW_SPAN) * (close - self.ema_slow)
+        macd_line = ema_fast - ema_slow
+        signal = self.signal + _alpha(SIGNAL_SPAN) * (macd_line - self.signal)
+
+        return ema_fast, ema_slow, signal, macd_line - signal
+
+    def update(self, date, close):
+        self.ema_fast, self.ema_slow, self.signal, histogram = self.step(close)
+        self.last_closed = date
+        self.count += 1
+        self.dates.append(date)
+        self.closes.append(close)
+        self.histogram.append(histogram)
+        self.macd.append(self.ema_fast - self.ema_slow)
+        for tracker in self.trackers.values():
+            tracker.append(close)
+
+    def tracker(self, prominence, distance):
+        key = (prominence, distance)
+        if key not in self.trackers:
+            tracker = PeakTracker(prominence, distance, self.max_bars)
+            tracker.offset = self.count - len(self.closes)
+            for close in self.closes:
+                tracker.append(close)
+            self.trackers[key] = tracker
+        return self.trackers[key]
+
+    def bar(self, index):
+        position = index - (self.count - len(self.closes))
+        return self.dates[position], self.closes[position], self.histogram[position]
+
+    def start_index(self, start_date):
+        if start_date is None or not self.dates:
+            return self.count - len(self.dates)
+        start = _localize(start_date, pd.DatetimeIndex([self.dates[0]]))
+        return self.count - len(self.dates) + bisect.bisect_left(self.dates, start)
+
+    def to_dict(self):
+        return {
+            'ema_fast': self.ema_fast,
+            'ema_slow': self.ema_slow,
+            'signal': self.signal,
+            'last_closed': None if self.last_closed is None else self.last_closed.isoformat(),
+            'count': self.count,
+            'dates': [d.isoformat() for d in self.dates],
+            'closes': list(self.closes),
+            'histogram': list(self.histogram),
+            'macd': list(self.macd)
+        }
+
+    @classmethod
+    def from_dict(cls, data, max_bars=MAX_BARS):
+        state = cls(max_bars)
+        state.ema_fast = data['ema_fast']
+        state.ema_slow = data['ema_slow']
+        state.signal = data['signal']
+        state.last_closed = None if data['last_closed'] is None else pd.Timestamp(data['last_closed'])
+        state.count = data.get('count', len(data['closes']))
+        state.dates.extend(pd.Timestamp(d) for d in data['dates'])
+        state.closes.extend(data['closes'])
+        state.histogram.extend(data['histogram'])
+        # snapshots from before the macd line was kept have NaN there
+        state.macd.extend(data.get('macd', [float('nan')] * len(data['closes'])))
+        return state
+
+
+class IndicatorEngine:
+    def __init__(self, max_bars=MAX_BARS):
+        self.max_bars = max_bars
+        self.states = {}
+
+    def get_state(self, ticker, interval):
+        key = (ticker, interval)
+        if key not in self.states:
+            self.states[key] = MACDState(self.max_bars)
+        return self.states[key]
+
+    def fetch_start(self, ticker, interval, start_date):
+        state = self.get_state(ticker, interval)
+        if state.last_closed is None:
+            return start_date
+        return max(pd.Timestamp(start_date), pd.Timestamp(state.last_closed.date())).strftime('%Y-%m-%d')
+
+    def update(self, ticker, interval, close_prices):
+        # every bar but the last one is closed and folded into the state for good,
+        # the last (possibly still forming) bar is only previewed
+        state = self.get_state(ticker, interval)
+
+        if len(close_prices) == 0:
+            return
+
+        closed = close_prices.iloc[:-1]
+        if state.last_closed is not None:
+            closed = closed[closed.index > state.last_closed]
+
+        for date, close in closed.items():
+            state.update(date, float(close))
+
+        forming_date = close_prices.index[-1]
+        if state.last_closed is None or forming_date > state.last_closed:
+            forming_close = float(close_prices.iloc[-1])
+            state.forming = (forming_date, forming_close, state.step(forming_close)[3])
+        else:
+            state.forming = None
+
+    def recent(self, ticker, interval):
+        state = self.get_state(ticker, interval)
+        if state.forming is not None:
+            return state.forming
+        if state.count == 0:
+            return None
+        return state.bar(state.count - 1)
+
+    def recent_peaks(self, ticker, interval, prominence, distance, start_date=None, n=1):
+        # same peaks as find_peaks(window['Close'], prominence, distance) on the window from start_date,
+        # without going over the window
+        state = self.get_state(ticker, interval)
+        forming_close = None if state.forming is None else state.forming[1]
+        peaks = state.tracker(prominence, distance).recent_peaks(n, state.start_index(start_date), forming_close)
+        return [state.bar(peak) for peak in peaks]
+
+    def window(self, ticker, interval, start_date=None):
+        state = self.get_state(ticker, interval)
+        dates = list(state.dates)
+        closes = list(state.closes)
+        histogram = list(state.histogram)
+        macd = list(state.macd)
+        if state.forming is not None:
+            ema_fast, ema_slow, _, forming_histogram = state.step(state.forming[1])
+            dates.append(state.forming[0])
+            closes.append(state.forming[1])
+            histogram.append(forming_histogram)
+            macd.append(ema_fast - ema_slow)
+
+        # MACD is the histogram, as everywhere else; MACD Line - MACD gives the signal line
+        window = pd.DataFrame({'Close': closes, 'MACD': histogram, 'MACD Line': macd}, index=pd.DatetimeIndex(dates))
+        if start_date is not None and len(window) > 0:
+            window = window[window.index >= _localize(start_date, window.index)]
+        return window
+
+    def snapshot(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        data = {f"{ticker}|{interval}": state.to_dict() for (ticker, interval), state in self.states.items()}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def restore(self, path):
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            data = json.load(f)
+        for key, state_data in data.items():
+            ticker, interval = key.split('|')
+            self.states[(ticker, interval)] = MACDState.from_dict(state_data, self.max_bars)
+        return True
+
+
+def _localize(date, index):
+    date = pd.Timestamp(date)
+    if index.tz is not None and date.tz is None:
+        date = date.tz_localize(index.tz)
+    return date
@@ -0,0 +1,156 @@
+import argparse
+import os
+import sys
+
+# every subcommand imports what it needs when it runs, so `main.py portfolio --status` does not pay for
+# yfinance, bs4, scipy or mplfinance
+
+
+def run_every(period, job, settle=None, name=None):
+    # just after every close of period (15m, 2m, ...) plus settle seconds, see scheduler
+    from scheduler import Scheduler, settle_seconds
+
+    Scheduler().every(period, job, settle_seconds if settle is None else settle, name).run()
+
+
+def signals(args):
+    import MACD_calculator
+
+    MACD_calculator.shards = args.shards
+    MACD_calculator.engine.restore(MACD_calculator.state_file)
+    MACD_calculator.job()
+    if not args.once:
+        run_every(args.every, MACD_calculator.job, args.settle, 'signals')
+
+
+def evaluate(args):
+    import findevaluation
+
+    findevaluation.job()
+    if not args.once:
+        from scheduler import settle_seconds
+
+        # a minute after the signals of the same close
+        run_every(args.every, findevaluation.job, settle_seconds + 60 if args.settle is None else args.settle,
+                  'evaluation')
+
+
+def portfolio(args):
+    import portfolio_manager
+
+    if args.status:
+        from portfolio_state import PortfolioState
+
+        state = PortfolioState.load(portfolio_manager.journal_file, portfolio_manager.portfolio_file,
+                                    portfolio_manager.history_file, portfolio_manager.take_profit,
+                                    portfolio_manager.stop_loss, portfolio_manager.leverage, read_only=True)
+        print(state.to_frame().to_string(index=False))
+        print(f"Realized Profit/Loss: ${state.realized:.2f}")
+        print(f"Open Profit/Loss: ${state.monetary.sum():.2f}")
+        return
+
+    portfolio_manager.update_portfolio()
+    if not args.once:
+        if args.watch:
+            from position_watcher import PositionWatcher
+
+            PositionWatcher().start()
+        run_every(args.every, portfolio_manager.scheduled_update, 0, 'portfolio')
+
+
+def plot(args):
+    if args.all:
+        import charts
+
+        for path in charts.render_all(directory=args.output or charts.charts_directory, days=args.days,
+                                      workers=args.workers):
+            print(path)
+        return
+
+    import importlib.util
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plot chart.py')
+    spec = importlib.util.spec_from_file_location('plot_chart', path)
+    plot_chart = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plot_chart)
+    plot_chart.plot(args.ticker, args.interval, args.days or 2.1)
+
+
+def run_all(args):
+    import MACD_calculator
+    from pipeline import run_pipeline
+
+    MACD_calculator.shards = args.shards
+    from scheduler import settle_seconds
+
+    run_pipeline(args.signals_every, args.portfolio_every, not args.no_persist, args.watch,
+                 settle_seconds if args.settle is None else args.settle)
+
+
+def once(args):
+    import MACD_calculator
+    from pipeline import Pipeline
+
+    MACD_calculator.shards = args.shards
+    MACD_calculator.engine.restore(MACD_calculator.state_file)
+    Pipeline(not args.no_persist).signals_stage()
+    if MACD_calculator.shard_pool is not None:
+        MACD_calculator.shard_pool.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='MACD divergence signals, evaluation and paper portfolio')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('signals', help='download bars and compute peak/MACD signals')
+    command.add_argument('--once', action='store_true', help='run one cycle and exit')
+    command.add_argument('--every', default='15m', help='run just after every close of this bar interval')
+    command.add_argument('--settle', type=float, help='seconds to wait after the close')
+    command.add_argument('--shards', type=int, default=0, help='worker processes to split the pairs over')
+    command.set_defaults(handler=signals)
+
+    command = commands.add_parser('evaluate', help='score the latest signals')
+    command.add_argument('--once', action='store_true', help='run one cycle and exit')
+    command.add_argument('--every', default='15m', help='run just after every close of this bar interval')
+    command.add_argument('--settle', type=float, help='seconds to wait after the close')
+    command.set_defaults(handler=evaluate)
+
+    command = commands.add_parser('portfolio', help='update the portfolio from the latest evaluation')
+    command.add_argument('--once', action='store_true', help='run one cycle and exit')
+    command.add_argument('--status', action='store_true', help='print open positions and profit, no downloads')
+    command.add_argument('--every', default='2m')
+    command.add_argument('--no-watch', dest='watch', action='store_false', help='no position watcher')
+    command.set_defaults(handler=portfolio)
+
+    command = commands.add_parser('plot', help='plot the chart of one pair')
+    command.add_argument('--ticker', default='GBPUSD=X')
+    command.add_argument('--interval', default='15m')
+    command.add_argument('--days', type=float, help='days shown, 2.1 for one chart and per interval with --all')
+    command.add_argument('--all', action='store_true', help='render every pair and interval to image files')
+    command.add_argument('--workers', type=int, help='processes for --all, one per cpu by default')
+    command.add_argument('--output', help='directory for --all')
+    command.set_defaults(handler=plot)
+
+    command = commands.add_parser('run-all', help='signals, evaluation and portfolio in one process')
+    command.add_argument('--signals-every', default='15m', help='signals just after every close of this interval')
+    command.add_argument('--portfolio-every', default='2m')
+    command.add_argument('--settle', type=float, help='seconds to wait after the close')
+    command.add_argument('--no-persist', action='store_true', help='do not write to the signal store')
+    command.add_argument('--no-watch', dest='watch', action='store_false', help='no position watcher')
+    command.add_argument('--shards', type=int, default=0, help='worker processes to split the pairs over')
+    command.set_defaults(handler=run_all)
+
+    command = commands.add_parser('once', help='one signals -> evaluation -> portfolio cycle, then exit')
+    command.add_argument('--no-persist', action='store_true', help='do not write to the signal store')
+    command.add_argument('--shards', type=int, default=0, help='worker processes to split the pairs over')
+    command.set_defaults(handler=once)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    try:
+        args.handler(args)
+    except KeyboardInterrupt:
+        sys.exit(130)
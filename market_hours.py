@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# the FX week runs from Sunday 17:00 to Friday 17:00 New York time; on the closed days below the market
+# is also shut from 17:00 the evening before
+NEW_YORK = ZoneInfo('America/New_York')
+ROLLOVER_HOUR = 17
+closed_days = [(12, 25), (1, 1)]
+check_market_hours = True
+
+
+def _trading_day(now):
+    # the session that starts at 17:00 New York belongs to the next calendar day
+    local = now.astimezone(NEW_YORK)
+    if local.hour >= ROLLOVER_HOUR:
+        local += timedelta(days=1)
+    return local.date()
+
+
+def is_fx_open(now=None):
+    if not check_market_hours:
+        return True
+    now = now or datetime.now(NEW_YORK)
+    if now.tzinfo is None:
+        now = now.astimezone()
+    day = _trading_day(now)
+    # trading days are Monday to Friday, Sunday evening belongs to Monday
+    return day.weekday() < 5 and (day.month, day.day) not in closed_days
+
+
+def next_open(now=None):
+    now = now or datetime.now(NEW_YORK)
+    if now.tzinfo is None:
+        now = now.astimezone()
+    if is_fx_open(now):
+        return now
+    local = now.astimezone(NEW_YORK)
+    candidate = local.replace(hour=ROLLOVER_HOUR, minute=0, second=0, microsecond=0)
+    if candidate <= local:
+        candidate += timedelta(days=1)
+    while not is_fx_open(candidate):
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def market_closed_message(now=None):
+    return f"FX market closed, next open at {next_open(now).strftime('%Y-%m-%d %H:%M %Z')}"
@@ -0,0 +1,218 @@
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+metrics_directory = os.getenv("METRICS_DIR", r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\metrics")
+PROFILE = os.getenv("METRICS_PROFILE") == "1"
+PREFIX = 'macd'
+
+
+class Metrics:
+    # per stage timings and event counters keyed by name and labels (ticker, interval, ...); everything is
+    # kept since start for the prometheus file and, separately, for the cycle that is running for the json log
+    def __init__(self, directory=metrics_directory, profile=PROFILE):
+        self.directory = directory
+        self.profile = profile
+        self.lock = threading.Lock()
+        # cycles finishing on different threads take turns writing the files
+        self.write_lock = threading.Lock()
+        self.observations = {}
+        self.counters = {}
+        # the cycle running on each thread: the scheduler threads and the position watcher run theirs at the
+        # same time, and pool threads working for a cycle join it through carry()
+        self.local = threading.local()
+
+    def current_cycle(self):
+        cycle = getattr(self.local, 'cycle', None)
+        return cycle if cycle is not None and cycle['observations'] is not None else None
+
+    def carry(self, function):
+        # function run on another thread records into the cycle of the thread that called carry
+        cycle = self.current_cycle()
+
+        def run(*args, **kwargs):
+            previous = getattr(self.local, 'cycle', None)
+            self.local.cycle = cycle
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.cycle = previous
+        return run
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        cycle = self.current_cycle()
+        with self.lock:
+            for observations in [self.observations, cycle and cycle['observations']]:
+                if observations is None:
+                    continue
+                count, total, maximum, _ = observations.get(key, (0, 0.0, value, value))
+                observations[key] = (count + 1, total + value, max(maximum, value), value)
+
+    def count(self, event, value=1, **labels):
+        key = (event, tuple(sorted(labels.items())))
+        cycle = self.current_cycle()
+        with self.lock:
+            for counters in [self.counters, cycle and cycle['counters']]:
+                if counters is not None:
+                    counters[key] = counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def collect(self):
+        # what the block records on this thread (and the threads it carries) as a delta for merge() in
+        # another process, the shard workers send theirs back with their results
+        delta = {}
+        cycle = {'depth': 1, 'observations': {}, 'counters': {}}
+        previous = getattr(self.local, 'cycle', None)
+        self.local.cycle = cycle
+        try:
+            yield delta
+        finally:
+            self.local.cycle = previous
+            with self.lock:
+                delta['observations'], cycle['observations'] = cycle['observations'], None
+                delta['counters'], cycle['counters'] = cycle['counters'], None
+
+    def merge(self, delta):
+        cycle = self.current_cycle()
+        with self.lock:
+            for observations in [self.observations, cycle and cycle['observations']]:
+                if observations is None:
+                    continue
+                for key, (count, total, maximum, last) in delta['observations'].items():
+                    if key in observations:
+                        previous_count, previous_total, previous_maximum, _ = observations[key]
+                        observations[key] = (previous_count + count, previous_total + total,
+                                             max(previous_maximum, maximum), last)
+                    else:
+                        observations[key] = (count, total, maximum, last)
+            for counters in [self.counters, cycle and cycle['counters']]:
+                if counters is None:
+                    continue
+                for key, value in delta['counters'].items():
+                    counters[key] = counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, stage, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def latency(self, stage, bar_date, **labels):
+        # seconds from the open of the most recent bar (the moment the bar before it closed) until now
+        if bar_date is None or bar_date == 'N/A' or pd.isna(bar_date):
+            return
+        bar_date = pd.Timestamp(bar_date)
+        if bar_date.tz is None:
+            bar_date = bar_date.tz_localize('UTC')
+        self.observe('latency_seconds', (pd.Timestamp.now(tz='UTC') - bar_date).total_seconds(), stage=stage,
+                     **labels)
+
+    @contextlib.contextmanager
+    def cycle(self, name):
+        # one json line and a fresh prometheus file per outermost cycle, cycles started inside it only time
+        cycle = self.current_cycle()
+        outermost = cycle is None
+        if outermost:
+            cycle = {'depth': 0, 'observations': {}, 'counters': {}}
+            self.local.cycle = cycle
+        with self.lock:
+            cycle['depth'] += 1
+
+        profiler = cProfile.Profile() if outermost and self.profile else None
+        started = datetime.now()
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            with self.timer('cycle', cycle=name):
+                yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            with self.lock:
+                cycle['depth'] -= 1
+            if outermost:
+                self.local.cycle = None
+                try:
+                    self._finish_cycle(cycle, name, started, time.perf_counter() - start, profiler)
+                except OSError as e:
+                    print(f"Error writing metrics: {e}")
+
+    def _finish_cycle(self, cycle, name, started, duration, profiler):
+        # pool threads still running for the cycle (timed out fetches) stop recording into it
+        with self.lock:
+            observations, cycle['observations'] = cycle['observations'], None
+            counters, cycle['counters'] = cycle['counters'], None
+
+        entry = {
+            'timestamp': started.isoformat(timespec='seconds'),
+            'cycle': name,
+            'duration': duration,
+            'observations': [{'name': key[0], **dict(key[1]), 'count': count, 'sum': total, 'max': maximum}
+                             for key, (count, total, maximum, _) in observations.items()],
+            'counters': [{'name': key[0], **dict(key[1]), 'value': value} for key, value in counters.items()]
+        }
+        with self.write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, 'cycles.jsonl'), 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+            self.write_prometheus(os.path.join(self.directory, 'metrics.prom'))
+
+        if profiler is not None:
+            profile_directory = os.path.join(self.directory, 'profiles')
+            os.makedirs(profile_directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_directory, f"{name}_{started.strftime('%Y%m%d_%H%M%S_%f')}.prof"))
+
+    def prometheus_text(self):
+        with self.lock:
+            observations = dict(self.observations)
+            counters = dict(self.counters)
+
+        lines = []
+        for name in sorted({key[0] for key in observations}):
+            metric = f"{PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            for key, (count, total, _, _) in observations.items():
+                if key[0] == name:
+                    lines.append(f"{metric}_sum{_labels(key[1])} {total}")
+                    lines.append(f"{metric}_count{_labels(key[1])} {count}")
+            for suffix, position in [('max', 2), ('last', 3)]:
+                lines.append(f"# TYPE {metric}_{suffix} gauge")
+                for key, values in observations.items():
+                    if key[0] == name:
+                        lines.append(f"{metric}_{suffix}{_labels(key[1])} {values[position]}")
+
+        for name in sorted({key[0] for key in counters}):
+            metric = f"{PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for key, value in counters.items():
+                if key[0] == name:
+                    lines.append(f"{metric}{_labels(key[1])} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # written next to the final file and renamed, so the node exporter never reads half a file
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+metrics = Metrics()
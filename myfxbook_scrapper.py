@@ -1,23 +1,114 @@
+import os
+import re
+import threading
+import time
+
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
+from metrics import metrics
 
-def get_short_percentage(ticker):
-    url = f'https://www.myfxbook.com/community/outlook/{ticker}'
+request_timeout = 10
+sentiment_ttl = 240
+
+OUTLOOK_URL = 'https://www.myfxbook.com/community/outlook'
+FIXTURE_DIRECTORY = os.getenv("MYFXBOOK_FIXTURE_DIR")
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.headers['Connection'] = 'keep-alive'
+
+SHORT_CELL = re.compile(r'<td[^>]*>\s*Short\s*</td>\s*<td[^>]*>\s*([0-9.]+)\s*%')
+SYMBOL_LINK = re.compile(r'href="(?:https://www\.myfxbook\.com)?/community/outlook/([A-Z0-9]+)"')
+
+
+class MyfxbookSource:
+    def __init__(self, session=session, timeout=request_timeout, url=OUTLOOK_URL):
+        self.session = session
+        self.timeout = timeout
+        self.url = url
+
+    def page(self, symbol=None):
+        url = self.url if symbol is None else f'{self.url}/{symbol}'
+        name = 'outlook overview' if symbol is None else f'ticker {symbol}'
+
+        metrics.count('myfxbook_requests')
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to retrieve data for {name}: {e}")
+            return None
+
+        if response.status_code != 200:
+            print(f"Failed to retrieve data for {name}, Status Code: {response.status_code}")
+            return None
+
+        return response.text
+
+
+class FixtureSource:
+    # offline source: <directory>/outlook.html for the overview and <directory>/<symbol>.html per symbol
+    def __init__(self, directory):
+        self.directory = directory
+
+    def page(self, symbol=None):
+        path = os.path.join(self.directory, 'outlook.html' if symbol is None else f"{symbol}.html")
+        if not os.path.exists(path):
+            print(f"No saved page at {path}")
+            return None
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+
+
+class StubMyfxbookServer:
+    # local stand-in for the outlook pages: GET / is source.page() and GET /<symbol> is source.page(symbol),
+    # a page the source does not have is a 404; point MyfxbookSource(url=stub.url) at it
+    def __init__(self, source, port=0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                symbol = self.path.strip('/') or None
+                page = source.page(symbol)
+                data = (page or '').encode()
+                self.send_response(200 if page is not None else 404)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
 
-    response = requests.get(url)
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
 
-    if response.status_code != 200:
-        print(f"Failed to retrieve data for ticker {ticker}, Status Code: {response.status_code}")
-        return None
 
-    soup = BeautifulSoup(response.text, 'html.parser')
+def parse_short_percentage(html):
+    # the Short rows are plain <td>Short</td><td>NN%</td> pairs, a regex finds them without building a tree;
+    # anything with markup inside the cells falls back to the full parse
+    short_data = [float(value) / 100 for value in SHORT_CELL.findall(html)]
+    if short_data:
+        return short_data
 
-    rows = soup.find_all('tr')
+    from bs4 import BeautifulSoup
 
-    short_data = []
+    soup = BeautifulSoup(html, 'html.parser')
 
-    for row in rows:
+    for row in soup.find_all('tr'):
         cols = row.find_all('td')
         if len(cols) > 1 and cols[0].text.strip() == 'Short':
             percentage_text = cols[1].text.strip()
@@ -26,3 +117,83 @@ def get_short_percentage(ticker):
 
     return short_data
 
+
+def parse_overview(html, symbols):
+    # the overview lists every pair once, each row linking to its own outlook page; the text between one
+    # link and the next belongs to that pair
+    wanted = set(symbols)
+    matches = list(SYMBOL_LINK.finditer(html))
+    short_data = {}
+
+    for i, match in enumerate(matches):
+        symbol = match.group(1)
+        if symbol not in wanted or symbol in short_data:
+            continue
+        end = len(html)
+        for following in matches[i + 1:]:
+            if following.group(1) != symbol:
+                end = following.start()
+                break
+        values = parse_short_percentage(html[match.start():end])
+        if values:
+            short_data[symbol] = values
+
+    return short_data
+
+
+class SentimentProvider:
+    # short percentages per symbol kept for ttl seconds; all stale symbols are read from the overview page in
+    # one request and only the ones it does not list are fetched from their own page
+    def __init__(self, source=None, ttl=sentiment_ttl):
+        self.source = source if source is not None else default_source()
+        self.ttl = ttl
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def get_many(self, symbols):
+        now = time.monotonic()
+        with self.lock:
+            result = {symbol: self.cache[symbol][0] for symbol in symbols
+                      if symbol in self.cache and now - self.cache[symbol][1] <= self.ttl}
+            missing = [symbol for symbol in dict.fromkeys(symbols) if symbol not in result]
+            metrics.count('sentiment_cache_hits', len(result))
+
+            if missing:
+                fetched = {}
+                overview = self.source.page()
+                if overview is not None:
+                    fetched = parse_overview(overview, missing)
+
+                for symbol in missing:
+                    if symbol not in fetched:
+                        page = self.source.page(symbol)
+                        if page is not None:
+                            fetched[symbol] = parse_short_percentage(page)
+
+                fetched_at = time.monotonic()
+                for symbol, values in fetched.items():
+                    self.cache[symbol] = (values, fetched_at)
+                result.update(fetched)
+
+        return result
+
+    def get(self, symbol):
+        return self.get_many([symbol]).get(symbol)
+
+
+def default_source():
+    if FIXTURE_DIRECTORY:
+        return FixtureSource(FIXTURE_DIRECTORY)
+    return MyfxbookSource()
+
+
+sentiment = SentimentProvider()
+
+
+def get_short_percentage(ticker):
+    return sentiment.get(ticker)
+
+
+def get_short_percentages(tickers):
+    with metrics.timer('sentiment'):
+        return sentiment.get_many(tickers)
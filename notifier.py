@@ -0,0 +1,171 @@
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+
+import requests
+
+from metrics import metrics
+
+MAX_MESSAGE_LENGTH = 4096
+request_timeout = 10
+
+
+class TelegramNotifier:
+    # messages are put on a bounded queue and sent by one background thread: whatever piles up within
+    # coalesce_window is joined into one message, posts to the chat are at least min_interval apart
+    # (telegram allows about 20 messages a minute to a group) and failed posts are retried with backoff
+    def __init__(self, api_url, chat_id, max_queue=100, coalesce_window=1.0, min_interval=3.0, max_retries=5,
+                 timeout=request_timeout):
+        self.api_url = api_url
+        self.chat_id = chat_id
+        self.coalesce_window = coalesce_window
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.session = requests.Session()
+        self.last_sent = 0.0
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        self._start()
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            metrics.count('telegram_dropped')
+            print(f"Telegram queue is full, dropping message: {message}")
+
+    def flush(self, timeout=None):
+        # waits until everything queued so far has been sent or given up on
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _start(self):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name='telegram-notifier', daemon=True)
+                self.worker.start()
+
+    def _run(self):
+        while True:
+            messages = [self.queue.get()]
+            deadline = time.monotonic() + self.coalesce_window
+            while True:
+                try:
+                    messages.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            try:
+                for text in _batches(messages):
+                    self._post(text)
+            except Exception as e:
+                print(f"Error sending Telegram message: {e}")
+            finally:
+                for _ in messages:
+                    self.queue.task_done()
+
+    def _post(self, text):
+        payload = {
+            'chat_id': self.chat_id,
+            'text': text,
+            'parse_mode': 'HTML'
+        }
+
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            wait = self.last_sent + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            try:
+                with metrics.timer('telegram'):
+                    response = self.session.post(self.api_url, data=payload, timeout=self.timeout)
+                metrics.count('telegram_posts', status=response.status_code)
+                self.last_sent = time.monotonic()
+                if response.status_code == 429:
+                    # telegram says how long to back off for in parameters.retry_after
+                    retry_after = response.json().get('parameters', {}).get('retry_after', delay)
+                    print(f"Telegram rate limit hit, retrying in {retry_after}s")
+                    time.sleep(retry_after)
+                    continue
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    return
+                print(f"Telegram returned {response.status_code}, attempt {attempt + 1}")
+            except requests.exceptions.HTTPError as e:
+                print(f"Error sending Telegram message: {e}")
+                return
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.last_sent = time.monotonic()
+                print(f"Error sending Telegram message, attempt {attempt + 1}: {e}")
+
+            time.sleep(delay)
+            delay *= 2
+
+        print(f"Giving up on Telegram message: {text}")
+
+
+def _batches(messages):
+    # one message per batch, split where it would go over telegram's length limit
+    batch = ''
+    for message in messages:
+        message = message[:MAX_MESSAGE_LENGTH]
+        if batch and len(batch) + 1 + len(message) > MAX_MESSAGE_LENGTH:
+            yield batch
+            batch = ''
+        batch = f"{batch}\n{message}" if batch else message
+    if batch:
+        yield batch
+
+
+class StubTelegramServer:
+    # local stand-in for api.telegram.org: records every sendMessage payload and can answer the first
+    # requests with given status codes, e.g. failures=[429, 500] to exercise retries
+    def __init__(self, port=0, failures=None):
+        self.messages = []
+        self.failures = list(failures or [])
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                if stub.failures:
+                    status = stub.failures.pop(0)
+                    reply = {'ok': False, 'error_code': status, 'parameters': {'retry_after': 1}}
+                else:
+                    status = 200
+                    payload = {key: values[0] for key, values in parse_qs(body).items()}
+                    stub.messages.append(payload)
+                    reply = {'ok': True, 'result': {'message_id': len(stub.messages)}}
+
+                data = json.dumps(reply).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/sendMessage"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
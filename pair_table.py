@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+pairs_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pairs.csv')
+volatility_file = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\state\volatility.csv"
+
+INTERVALS = ['15m', '60m', '90m']
+PARAMETER_COLUMNS = ['Prominence', 'Distance', 'Price Threshold', 'MACD Threshold']
+
+atr_period = 14
+volatility_days = 30
+# derived values for cells left empty in pairs.csv
+atr_multipliers = {'Prominence': 1.0, 'Price Threshold': 1.0, 'MACD Threshold': 1.0}
+default_distance = {'15m': 3, '60m': 5, '90m': 16}
+
+
+def load_pairs(path=pairs_file, volatility_path=volatility_file, intervals=INTERVALS):
+    # one row per ticker and interval; a row without an Interval applies to every interval and empty
+    # parameter cells are derived from the volatility table when there is one
+    table = pd.read_csv(path)
+    for column in ['Enabled', 'Interval'] + PARAMETER_COLUMNS:
+        if column not in table:
+            table[column] = np.nan
+    table['Enabled'] = table['Enabled'].fillna(1).astype(bool)
+
+    expanded = table[table['Interval'].isna()].drop(columns='Interval').merge(pd.DataFrame({'Interval': intervals}),
+                                                                             how='cross')
+    table = pd.concat([table[table['Interval'].notna()], expanded], ignore_index=True)
+    table = table.drop_duplicates(['Ticker', 'Interval'], keep='first')
+
+    if volatility_path is not None and os.path.exists(volatility_path):
+        table = derive_parameters(table, pd.read_csv(volatility_path))
+    table['Distance'] = table['Distance'].fillna(table['Interval'].map(default_distance))
+
+    return table.reset_index(drop=True)
+
+
+def derive_parameters(table, volatility):
+    # prominence from the ATR in price units, the price threshold from the ATR relative to the close
+    # (evaluation compares relative moves) and the MACD threshold from the spread of the histogram
+    # one volatility row per ticker and interval, or the merge adds rows and the derived values no longer line
+    # up with table; a repeated key keeps its last (most recently appended) row
+    duplicated = volatility.duplicated(['Ticker', 'Interval'], keep='last')
+    if duplicated.any():
+        print(f"Dropping {duplicated.sum()} repeated ticker/interval rows from the volatility table")
+        volatility = volatility[~duplicated]
+    merged = table.merge(volatility, on=['Ticker', 'Interval'], how='left', validate='many_to_one')
+    derived = {
+        'Prominence': merged['ATR'] * atr_multipliers['Prominence'],
+        'Price Threshold': merged['ATR'] / merged['Close'] * atr_multipliers['Price Threshold'],
+        'MACD Threshold': merged['MACD Std'] * atr_multipliers['MACD Threshold']
+    }
+    table = table.copy()
+    for column, values in derived.items():
+        table[column] = table[column].fillna(pd.Series(values.to_numpy(), index=table.index))
+    return table
+
+
+def pair_tickers(table):
+    return list(dict.fromkeys(table.loc[table['Enabled'], 'Ticker']))
+
+
+def pair_parameters(table, intervals=INTERVALS):
+    # the prominence/distance lists make_df expects, in the order of intervals; pairs missing any of them
+    # are left out
+    parameters = {}
+    for ticker, rows in table.groupby('Ticker', sort=False):
+        rows = rows.set_index('Interval').reindex(intervals)
+        if rows[['Prominence', 'Distance']].isna().any().any():
+            print(f"No prominence/distance for every interval of {ticker}, skipping it")
+            continue
+        parameters[ticker] = {
+            'prominence': rows['Prominence'].tolist(),
+            'distance': rows['Distance'].astype(int).tolist()
+        }
+    return parameters
+
+
+def pair_thresholds(table):
+    thresholds = {}
+    for ticker, rows in table.groupby('Ticker', sort=False):
+        rows = rows.set_index('Interval')
+        thresholds[ticker.split('=')[0]] = {
+            'price': rows['Price Threshold'].dropna().to_dict(),
+            'macd': rows['MACD Threshold'].dropna().to_dict()
+        }
+    return thresholds
+
+
+def atr(bars, period=atr_period):
+    previous_close = bars['Close'].shift()
+    true_range = pd.concat([bars['High'] - bars['Low'], (bars['High'] - previous_close).abs(),
+                            (bars['Low'] - previous_close).abs()], axis=1).max(axis=1)
+    return true_range.ewm(alpha=1.0 / period, adjust=False).mean()
+
+
+def compute_volatility(cache, tickers, intervals=INTERVALS, days=volatility_days):
+    from datetime import datetime, timedelta
+    from sweep import macd_histogram
+
+    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    end_date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    rows = []
+    for ticker in tickers:
+        try:
+            frames = cache.get_timeframes(ticker, [start_date] * len(intervals), end_date, intervals)
+        except Exception as e:
+            print(f"Error fetching bars for {ticker}: {e}")
+            continue
+        for interval, bars in frames.items():
+            if len(bars) <= atr_period:
+                print(f"Not enough {interval} bars for {ticker}")
+                continue
+            rows.append({
+                'Ticker': ticker,
+                'Interval': interval,
+                'ATR': atr(bars).iloc[-1],
+                'Close': bars['Close'].iloc[-1],
+                'MACD Std': float(np.std(macd_histogram(bars['Close'])))
+            })
+    return pd.DataFrame(rows, columns=['Ticker', 'Interval', 'ATR', 'Close', 'MACD Std'])
+
+
+if __name__ == '__main__':
+    from MACD_calculator import cache
+
+    table = load_pairs(volatility_path=None)
+    volatility = compute_volatility(cache, list(dict.fromkeys(table['Ticker'])))
+    os.makedirs(os.path.dirname(volatility_file), exist_ok=True)
+    volatility.to_csv(volatility_file, index=False)
+    print(volatility)
@@ -0,0 +1,192 @@
+import bisect
+import math
+
+import numpy as np
+
+MAX_BARS = 1000
+
+
+class PeakTracker:
+    # incremental equivalent of find_peaks(x, prominence=..., distance=...) over a window that only grows
+    # on the right and is cut on the left by a start index:
+    # - local maxima (with flat tops) are confirmed as bars arrive,
+    # - a monotonic stack gives each bar the min back to the previous strictly higher bar (left base),
+    # - a second monotonic stack gives the min forward to the next strictly higher bar (right base),
+    # so the prominence of a peak never needs a scan over the whole window
+    def __init__(self, prominence, distance, max_bars=MAX_BARS):
+        self.prominence = prominence
+        self.distance = max(1, math.ceil(distance))
+        self.max_bars = max_bars
+
+        self.offset = 0
+        self.values = []
+        self.left_min = []
+        self.prev_greater = []
+        self.right_min = {}
+
+        self.left_stack = []
+        self.right_stack = []
+        self.right_values = []
+        self.right_gaps = []
+
+        self.peaks = []
+        self.left_edges = []
+        self.rise_start = None
+
+    def __len__(self):
+        return self.offset + len(self.values)
+
+    def value(self, index):
+        return self.values[index - self.offset]
+
+    def append(self, value):
+        index = len(self)
+        previous = self.values[-1] if self.values else None
+
+        if self.rise_start is not None:
+            top = self.value(self.rise_start)
+            if value < top:
+                self.peaks.append((self.rise_start + index - 1) // 2)
+                self.left_edges.append(self.rise_start)
+                self.rise_start = None
+            elif value > top:
+                self.rise_start = index
+        elif previous is not None and previous < value:
+            self.rise_start = index
+
+        left_min = value
+        while self.left_stack and self.left_stack[-1][1] <= value:
+            left_min = min(left_min, self.left_stack.pop()[2])
+        self.prev_greater.append(self.left_stack[-1][0] if self.left_stack else -1)
+        self.left_stack.append((index, value, left_min))
+        self.left_min.append(left_min)
+
+        while self.right_values and self.right_values[-1] < value:
+            popped = self.right_stack.pop()
+            popped_value = self.right_values.pop()
+            gap = self.right_gaps.pop()
+            self.right_min[popped] = min(popped_value, gap)
+            if self.right_gaps:
+                self.right_gaps[-1] = min(self.right_gaps[-1], popped_value, gap)
+        if self.right_gaps:
+            self.right_gaps[-1] = min(self.right_gaps[-1], value)
+        self.right_stack.append(index)
+        self.right_values.append(value)
+        self.right_gaps.append(math.inf)
+
+        self.values.append(value)
+        if len(self.values) > 2 * self.max_bars:
+            self._trim(len(self) - self.max_bars)
+
+    def _trim(self, start):
+        drop = start - self.offset
+        self.values = self.values[drop:]
+        self.left_min = self.left_min[drop:]
+        self.prev_greater = self.prev_greater[drop:]
+        self.offset = start
+        self.right_min = {index: value for index, value in self.right_min.items() if index >= start}
+        keep = bisect.bisect_left(self.left_edges, start + 1)
+        self.peaks = self.peaks[keep:]
+        self.left_edges = self.left_edges[keep:]
+
+    def _prominence(self, peak, start, forming):
+        height = self.value(peak)
+
+        if self.prev_greater[peak - self.offset] >= start:
+            left_min = self.left_min[peak - self.offset]
+        else:
+            left_min = min(self.values[start - self.offset:peak - self.offset + 1])
+
+        if peak in self.right_min:
+            right_min = self.right_min[peak]
+        else:
+            position = bisect.bisect_left(self.right_stack, peak)
+            right_min = min([height] + self.right_gaps[position:])
+            if forming is not None and forming <= height:
+                right_min = min(right_min, forming)
+
+        return height - max(left_min, right_min)
+
+    def recent_peaks(self, n=1, start=0, forming=None):
+        # the n most recent peaks (oldest first) that find_peaks would return for values[start:]
+        # followed by the still forming bar, if one is given
+        start = max(start, self.offset)
+        first = bisect.bisect_left(self.left_edges, start + 1)
+        forming_peak = None
+        if forming is not None and self.rise_start is not None and forming < self.value(self.rise_start):
+            forming_peak = (self.rise_start + len(self) - 1) // 2
+        count = len(self.peaks) - first + (forming_peak is not None)
+
+        def peak_at(position):
+            if first + position == len(self.peaks):
+                return forming_peak
+            return self.peaks[first + position]
+
+        kept = {}
+
+        # the higher peak wins; equal heights within distance are left to np.argsort by find_peaks, which is
+        # not stable, so a tie met on the way hands the whole window to the same selection (see _scipy_kept)
+        def priority(position):
+            return self.value(peak_at(position))
+
+        def neighbours(position):
+            k = position - 1
+            while k >= 0 and peak_at(position) - peak_at(k) < self.distance:
+                yield k
+                k -= 1
+            k = position + 1
+            while k < count and peak_at(k) - peak_at(position) < self.distance:
+                yield k
+                k += 1
+
+        def is_kept(position):
+            # a peak survives the distance filter unless a surviving, higher priority peak is too close
+            pending = [position]
+            while pending:
+                current = pending[-1]
+                if current in kept:
+                    pending.pop()
+                    continue
+                close_by = list(neighbours(current))
+                if any(self.value(peak_at(k)) == self.value(peak_at(current)) for k in close_by):
+                    return None
+                blockers = [k for k in close_by if priority(k) > priority(current)]
+                unresolved = [k for k in blockers if k not in kept]
+                if unresolved:
+                    pending.extend(unresolved)
+                    continue
+                kept[current] = not any(kept[k] for k in blockers)
+                pending.pop()
+            return kept[position]
+
+        scipy_kept = None
+        found = []
+        for position in range(count - 1, -1, -1):
+            if len(found) == n:
+                break
+            if scipy_kept is None and is_kept(position) is None:
+                scipy_kept = self._scipy_kept([peak_at(k) for k in range(count)])
+            if not (scipy_kept[position] if scipy_kept is not None else kept[position]):
+                continue
+            if self._prominence(peak_at(position), start, forming) >= self.prominence:
+                found.append(peak_at(position))
+
+        return found[::-1]
+
+    def _scipy_kept(self, peaks):
+        # scipy's _select_by_peak_distance over every peak of the window: the same np.argsort of the same
+        # heights, so ties are resolved as find_peaks resolves them
+        heights = np.array([self.value(peak) for peak in peaks], dtype='float64')
+        keep = np.ones(len(peaks), dtype=bool)
+        for j in np.argsort(heights)[::-1]:
+            if not keep[j]:
+                continue
+            k = j - 1
+            while k >= 0 and peaks[j] - peaks[k] < self.distance:
+                keep[k] = False
+                k -= 1
+            k = j + 1
+            while k < len(peaks) and peaks[k] - peaks[j] < self.distance:
+                keep[k] = False
+                k += 1
+        return keep
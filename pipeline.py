@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import MACD_calculator
+import findevaluation
+import portfolio_manager
+from signal_store import SignalStore, frame_signature
+from market_hours import is_fx_open, market_closed_message
+from metrics import metrics
+from position_watcher import PositionWatcher
+from bar_cache import BASE_INTERVAL
+from scheduler import Scheduler, settle_seconds
+
+
+class Pipeline:
+    # signals -> evaluation -> portfolio run back to back in one process, each stage handing its frame
+    # straight to the next one; the signal store is only written to when persist is on
+    def __init__(self, persist=True):
+        self.persist = persist
+        self.latest_evaluation = None
+        self.signals_signature = None
+
+    def signals_stage(self):
+        if not is_fx_open():
+            print(market_closed_message())
+            return
+
+        print(f"Starting signal retrieval at {datetime.now()}...")
+        with metrics.cycle('pipeline'):
+            signals = MACD_calculator.make_df(save=self.persist)
+            print(signals)
+
+            # the same signals as last cycle score the same, evaluation and portfolio keep their last result
+            signature = frame_signature(signals)
+            if signature == self.signals_signature:
+                print("Signals unchanged since the last cycle, skipping evaluation")
+                return
+            self.signals_signature = signature
+            MACD_calculator.snapshot_state()
+
+            self.evaluation_stage(signals)
+
+    def evaluation_stage(self, signals):
+        evaluated = findevaluation.evaluate(signals.copy())
+        print(evaluated)
+
+        if not findevaluation.is_actionable(evaluated):
+            return
+
+        if self.persist:
+            findevaluation.save_evaluation(evaluated)
+        self.latest_evaluation = evaluated
+
+        self.portfolio_stage()
+
+    def portfolio_stage(self):
+        if not is_fx_open():
+            print(market_closed_message())
+            return
+
+        if self.latest_evaluation is None:
+            try:
+                with SignalStore() as store:
+                    self.latest_evaluation = store.latest('evals')
+            except FileNotFoundError as e:
+                print(f"No evaluation to manage the portfolio with yet: {e}")
+                return
+
+        portfolio_manager.update_portfolio(self.latest_evaluation.copy())
+
+
+def run_pipeline(signals_every=BASE_INTERVAL, portfolio_every='2m', persist=True, watch_positions=True,
+                 settle=settle_seconds):
+    # signals just after every bar close, the portfolio on its own thread in between; the portfolio state
+    # lock keeps the two from updating positions at the same time
+    pipeline = Pipeline(persist)
+    MACD_calculator.engine.restore(MACD_calculator.state_file)
+
+    pipeline.signals_stage()
+    if watch_positions:
+        PositionWatcher().start()
+    scheduler = Scheduler()
+    scheduler.every(signals_every, pipeline.signals_stage, settle, 'signals')
+    scheduler.every(portfolio_every, pipeline.portfolio_stage, name='portfolio')
+    scheduler.run()
+
+
+if __name__ == '__main__':
+    run_pipeline()
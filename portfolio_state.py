@@ -0,0 +1,289 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+portfolio_columns = ['Timestamp', 'Ticker', 'Transaction Date', 'Transaction Price', 'Investment Amount', 'Position',
+                     'Current Price', 'Profit/Loss', 'Monetary Gain/Loss', 'Take Profit', 'Stop Loss',
+                     'Min Profit/Loss', 'Max Profit/Loss']
+history_columns = ['Transaction Date', 'Close Date', 'Ticker', 'Open @ Price', 'Investment Amount', 'Position',
+                   'Closed @ Price', 'Profit/Loss', 'Monetary Gain/Loss', 'Min Profit/Loss', 'Max Profit/Loss',
+                   'Action']
+date_format = '%Y-%m-%d %H:%M:%S'
+# journal events after which save_snapshot rewrites the journal as one checkpoint, so a start replays the
+# open positions instead of the whole trading history
+compact_after = 500
+
+
+class PortfolioState:
+    # open positions live in parallel numpy arrays (one slot per position) and realized P&L is a running sum;
+    # every open and close is appended to a jsonl journal, which is replayed on start to recover the state and
+    # compacted into a checkpoint event once it grows past compact_after
+    def __init__(self, journal_file, portfolio_file, history_file, take_profit, stop_loss, leverage, read_only=False):
+        self.journal_file = journal_file
+        self.portfolio_file = portfolio_file
+        self.history_file = history_file
+        self.take_profit = take_profit
+        self.stop_loss = stop_loss
+        self.leverage = leverage
+        # a read only state is recovered as usual but never writes the journal or the csv files
+        self.read_only = read_only
+
+        self.timestamp = []
+        self.ticker = []
+        self.transaction_date = []
+        self.transaction_price = np.empty(0)
+        self.investment = np.empty(0)
+        self.long = np.empty(0, dtype=bool)
+        self.current_price = np.empty(0)
+        self.profit_loss = np.empty(0)
+        self.min_profit_loss = np.empty(0)
+        self.max_profit_loss = np.empty(0)
+        self.realized = 0.0
+        self.journal_events = 0
+        # held by update_portfolio and the position watcher, which run in different threads
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.ticker)
+
+    @classmethod
+    def load(cls, journal_file, portfolio_file, history_file, take_profit, stop_loss, leverage, read_only=False):
+        state = cls(journal_file, portfolio_file, history_file, take_profit, stop_loss, leverage, read_only)
+
+        if os.path.exists(journal_file):
+            with open(journal_file) as f:
+                for line in f:
+                    if line.strip():
+                        state._apply(json.loads(line))
+                        state.journal_events += 1
+        else:
+            state._bootstrap()
+
+        # the journal knows which positions are open; the last snapshot adds their price and Min/Max P/L
+        if os.path.exists(portfolio_file) and len(state) > 0:
+            snapshot = pd.read_csv(portfolio_file)
+            for _, row in snapshot.iterrows():
+                for i in range(len(state)):
+                    if state.ticker[i] == row['Ticker'] and state.transaction_date[i] == row['Transaction Date']:
+                        state.current_price[i] = row['Current Price']
+                        state.profit_loss[i] = row['Profit/Loss']
+                        state.min_profit_loss[i] = row['Min Profit/Loss']
+                        state.max_profit_loss[i] = row['Max Profit/Loss']
+
+        return state
+
+    def _bootstrap(self):
+        # first start on top of the old csv files: carry realized P&L and open positions into a new journal
+        realized = 0.0
+        if os.path.exists(self.history_file):
+            history = pd.read_csv(self.history_file)
+            if not history.empty:
+                realized = float(history['Monetary Gain/Loss'].sum())
+        self._journal({'event': 'bootstrap', 'realized': realized})
+        self._apply({'event': 'bootstrap', 'realized': realized})
+
+        if os.path.exists(self.portfolio_file):
+            for _, row in pd.read_csv(self.portfolio_file).iterrows():
+                self.open(row['Ticker'], row['Transaction Price'], row['Position'], row['Investment Amount'],
+                          row['Transaction Date'], row['Timestamp'])
+
+    def _journal(self, event):
+        if self.read_only:
+            return
+        os.makedirs(os.path.dirname(self.journal_file) or '.', exist_ok=True)
+        with open(self.journal_file, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_events += 1
+
+    def checkpoint(self):
+        return {'event': 'checkpoint', 'realized': float(self.realized),
+                'positions': [_plain(row) for row in self.to_frame().to_dict('records')]}
+
+    def compact(self):
+        # the journal becomes a single checkpoint of realized P&L and the open positions, written next to it
+        # and renamed so a crash leaves either the old journal or the new one
+        if self.read_only:
+            return
+        tmp_file = self.journal_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps(self.checkpoint()) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.journal_file)
+        self.journal_events = 1
+
+    def _apply(self, event):
+        if event['event'] == 'bootstrap':
+            self.realized = event['realized']
+        elif event['event'] == 'checkpoint':
+            self._remove(list(range(len(self))))
+            self.realized = event['realized']
+            for row in event['positions']:
+                self._apply({'event': 'open', 'ticker': row['Ticker'], 'price': row['Transaction Price'],
+                             'position': row['Position'], 'investment': row['Investment Amount'],
+                             'date': row['Transaction Date'], 'timestamp': row['Timestamp']})
+                self.current_price[-1] = row['Current Price']
+                self.profit_loss[-1] = row['Profit/Loss']
+                self.min_profit_loss[-1] = row['Min Profit/Loss']
+                self.max_profit_loss[-1] = row['Max Profit/Loss']
+        elif event['event'] == 'open':
+            self.timestamp.append(event['timestamp'])
+            self.ticker.append(event['ticker'])
+            self.transaction_date.append(event['date'])
+            self.transaction_price = np.append(self.transaction_price, event['price'])
+            self.investment = np.append(self.investment, event['investment'])
+            self.long = np.append(self.long, event['position'] == 'Long')
+            self.current_price = np.append(self.current_price, event['price'])
+            self.profit_loss = np.append(self.profit_loss, 0.0)
+            self.min_profit_loss = np.append(self.min_profit_loss, 0.0)
+            self.max_profit_loss = np.append(self.max_profit_loss, 0.0)
+        elif event['event'] == 'close':
+            i = self.index(event['ticker'], event['date'])
+            self.realized += event['monetary']
+            self._remove([i])
+
+    def index(self, ticker, transaction_date):
+        for i in range(len(self)):
+            if self.ticker[i] == ticker and self.transaction_date[i] == transaction_date:
+                return i
+        raise KeyError(f"No open position {ticker} opened at {transaction_date}")
+
+    def _remove(self, indices):
+        keep = np.ones(len(self), dtype=bool)
+        keep[indices] = False
+        self.timestamp = [value for value, k in zip(self.timestamp, keep) if k]
+        self.ticker = [value for value, k in zip(self.ticker, keep) if k]
+        self.transaction_date = [value for value, k in zip(self.transaction_date, keep) if k]
+        for name in ['transaction_price', 'investment', 'long', 'current_price', 'profit_loss',
+                     'min_profit_loss', 'max_profit_loss']:
+            setattr(self, name, getattr(self, name)[keep])
+
+    @property
+    def monetary(self):
+        return self.investment * self.profit_loss * self.leverage / 100
+
+    @property
+    def take_profit_level(self):
+        return self.take_profit + self.min_profit_loss
+
+    @property
+    def stop_loss_level(self):
+        return self.stop_loss + self.max_profit_loss
+
+    def holds(self, ticker):
+        return ticker in self.ticker
+
+    def profit_loss_at(self, prices):
+        move = (prices - self.transaction_price) / self.transaction_price * 100
+        return np.where(self.long, move, -move)
+
+    def price_at(self, profit_loss):
+        move = np.where(self.long, profit_loss, -profit_loss)
+        return self.transaction_price * (1 + move / 100)
+
+    def mark_bars(self, highs, lows, closes):
+        # Min/Max from the whole range of each bar instead of one close; NaN where a position got no bar
+        best = self.profit_loss_at(np.where(self.long, highs, lows))
+        worst = self.profit_loss_at(np.where(self.long, lows, highs))
+        self.min_profit_loss = np.fmin(self.min_profit_loss, worst)
+        self.max_profit_loss = np.fmax(self.max_profit_loss, best)
+        self.current_price = np.where(np.isnan(closes), self.current_price, closes)
+        self.profit_loss = self.profit_loss_at(self.current_price)
+
+    def mark(self, prices):
+        # Min/Max are taken from the P/L of the previous mark before it is recomputed, as update_portfolio always did
+        for i, ticker in enumerate(self.ticker):
+            price = prices.get(ticker)
+            if price is not None:
+                self.current_price[i] = price
+
+        self.min_profit_loss = np.fmin(self.min_profit_loss, self.profit_loss)
+        self.max_profit_loss = np.fmax(self.max_profit_loss, self.profit_loss)
+        move = (self.current_price - self.transaction_price) / self.transaction_price * 100
+        self.profit_loss = np.where(self.long, move, -move)
+
+    def open(self, ticker, price, position, investment, date=None, timestamp=None):
+        date = date or datetime.now().strftime(date_format)
+        event = {'event': 'open', 'ticker': ticker, 'price': float(price), 'position': position,
+                 'investment': float(investment), 'date': date, 'timestamp': timestamp or date}
+        self._journal(event)
+        self._apply(event)
+
+    def close(self, indices, actions, close_date=None, prices=None):
+        # prices, if given, are the fill prices of the positions being closed
+        close_date = close_date or datetime.now().strftime(date_format)
+        if prices is not None:
+            self.current_price[list(indices)] = prices
+            self.profit_loss = self.profit_loss_at(self.current_price)
+        monetary = self.monetary
+        entries = []
+        for i, action in zip(indices, actions):
+            entry = {
+                'Transaction Date': self.transaction_date[i],
+                'Close Date': close_date,
+                'Ticker': self.ticker[i],
+                'Open @ Price': self.transaction_price[i],
+                'Investment Amount': self.investment[i],
+                'Position': 'Long' if self.long[i] else 'Short',
+                'Closed @ Price': self.current_price[i],
+                'Profit/Loss': self.profit_loss[i],
+                'Monetary Gain/Loss': monetary[i],
+                'Min Profit/Loss': self.min_profit_loss[i],
+                'Max Profit/Loss': self.max_profit_loss[i],
+                'Action': action
+            }
+            self._journal({'event': 'close', 'ticker': self.ticker[i], 'date': self.transaction_date[i],
+                           'monetary': float(monetary[i]), 'entry': _plain(entry)})
+            self.realized += float(monetary[i])
+            entries.append(entry)
+
+        self._remove(list(indices))
+        if entries:
+            self._append_history(entries)
+        return entries
+
+    def _append_history(self, entries):
+        os.makedirs(os.path.dirname(self.history_file) or '.', exist_ok=True)
+        if os.path.exists(self.history_file):
+            with open(self.history_file) as f:
+                columns = f.readline().strip().split(',')
+            pd.DataFrame(entries).reindex(columns=columns).to_csv(self.history_file, mode='a', header=False,
+                                                                  index=False)
+        else:
+            pd.DataFrame(entries, columns=history_columns).to_csv(self.history_file, index=False)
+
+    def to_frame(self):
+        return pd.DataFrame({
+            'Timestamp': self.timestamp,
+            'Ticker': self.ticker,
+            'Transaction Date': self.transaction_date,
+            'Transaction Price': self.transaction_price,
+            'Investment Amount': self.investment,
+            'Position': np.where(self.long, 'Long', 'Short'),
+            'Current Price': self.current_price,
+            'Profit/Loss': self.profit_loss,
+            'Monetary Gain/Loss': self.monetary,
+            'Take Profit': self.take_profit_level,
+            'Stop Loss': self.stop_loss_level,
+            'Min Profit/Loss': self.min_profit_loss,
+            'Max Profit/Loss': self.max_profit_loss
+        }, columns=portfolio_columns)
+
+    def save_snapshot(self):
+        os.makedirs(os.path.dirname(self.portfolio_file) or '.', exist_ok=True)
+        tmp_file = self.portfolio_file + '.tmp'
+        self.to_frame().to_csv(tmp_file, index=False)
+        os.replace(tmp_file, self.portfolio_file)
+
+        if self.journal_events > compact_after:
+            self.compact()
+
+
+def _plain(entry):
+    return {key: value.item() if isinstance(value, np.generic) else value for key, value in entry.items()}
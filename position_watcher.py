@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import portfolio_manager
+from metrics import metrics
+from portfolio_state import date_format
+from quote_service import quotes
+from market_hours import is_fx_open
+
+poll_seconds = 5
+
+
+def entry_time(transaction_date, tz=None):
+    # transaction dates are naive local time (datetime.now()), bars carry the timezone of their feed
+    opened = pd.Timestamp(transaction_date)
+    if tz is not None:
+        opened = opened.tz_localize(datetime.now().astimezone().tzinfo).tz_convert(tz)
+    return opened
+
+
+class YahooBarFeed:
+    # 1m bars of today for the given symbols, each call returns only the bars not returned before (on the
+    # first call, the bars from since on: the entry of the symbol's earliest open position); the last bar is
+    # still forming, so it comes again (with its range so far) until it is complete
+    def __init__(self, interval='1m'):
+        self.interval = interval
+        self.last_seen = {}
+
+    def poll(self, symbols, since=None):
+        import yfinance as yf
+
+        data = yf.download(symbols, period='1d', interval=self.interval, group_by='ticker', progress=False,
+                           threads=False)
+        bars = []
+        for symbol in symbols:
+            try:
+                frame = data[symbol] if isinstance(data.columns, pd.MultiIndex) else data
+            except KeyError:
+                continue
+            frame = frame.dropna(subset=['Close'])
+            last_seen = self.last_seen.get(symbol)
+            if last_seen is None and since is not None and symbol in since:
+                last_seen = entry_time(since[symbol], frame.index.tz)
+            if last_seen is not None:
+                frame = frame[frame.index >= last_seen]
+            if len(frame) == 0:
+                continue
+            self.last_seen[symbol] = frame.index[-1]
+            bars.extend((date, symbol, row['High'], row['Low'], row['Close']) for date, row in frame.iterrows())
+        return sorted(bars, key=lambda bar: bar[0])
+
+
+class ReplayFeed:
+    # replays saved bars (<directory>/<symbol>_<interval>.csv, the LocalProvider layout) a few bars per poll
+    def __init__(self, directory, interval='1m', bars_per_poll=1, start=None):
+        self.frames = {}
+        self.directory = directory
+        self.interval = interval
+        self.bars_per_poll = bars_per_poll
+        self.start = start
+        self.position = {}
+
+    def frame(self, symbol):
+        if symbol not in self.frames:
+            path = os.path.join(self.directory, f"{symbol}_{self.interval}.csv")
+            frame = pd.read_csv(path, index_col=0, parse_dates=True) if os.path.exists(path) else pd.DataFrame()
+            if self.start is not None and len(frame) > 0:
+                frame = frame[frame.index >= pd.Timestamp(self.start)]
+            self.frames[symbol] = frame
+        return self.frames[symbol]
+
+    def poll(self, symbols, since=None):
+        bars = []
+        for symbol in symbols:
+            frame = self.frame(symbol)
+            position = self.position.get(symbol, 0)
+            if position == 0 and since is not None and symbol in since and len(frame) > 0:
+                position = int(frame.index.searchsorted(entry_time(since[symbol], frame.index.tz)))
+            for date, row in frame.iloc[position:position + self.bars_per_poll].iterrows():
+                bars.append((date, symbol, row['High'], row['Low'], row['Close']))
+            self.position[symbol] = min(position + self.bars_per_poll, len(frame))
+        return sorted(bars, key=lambda bar: bar[0])
+
+    def exhausted(self, symbols):
+        return all(self.position.get(symbol, 0) >= len(self.frame(symbol)) for symbol in symbols)
+
+
+class PositionWatcher:
+    # follows a fast bar feed for the open positions only: Min/Max P/L come from bar highs and lows and a
+    # position is closed on the bar that crosses its trailing stop or take profit, filled at that level;
+    # the evaluation part of the take profit rule uses the Total Evaluation of the last portfolio cycle
+    def __init__(self, feed=None, poll_seconds=poll_seconds):
+        self.feed = feed if feed is not None else YahooBarFeed()
+        self.poll_seconds = poll_seconds
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def poll(self):
+        portfolio = portfolio_manager.get_state()
+        with portfolio.lock:
+            since = {}
+            for ticker, transaction_date in zip(portfolio.ticker, portfolio.transaction_date):
+                symbol = f"{ticker}=X"
+                since[symbol] = min(since.get(symbol, transaction_date), transaction_date,
+                                    key=pd.Timestamp)
+            symbols = list(since)
+        if not symbols:
+            return []
+
+        with metrics.timer('watcher_feed'):
+            try:
+                bars = self.feed.poll(symbols, since)
+            except Exception as e:
+                print(f"Error polling bars for {', '.join(symbols)}: {e}")
+                return []
+
+        closed = []
+        with portfolio.lock:
+            for date, symbol, high, low, close in bars:
+                closed.extend(self.on_bar(portfolio, date, symbol.split('=')[0], high, low, close))
+                quotes.publish(symbol, close)
+            if bars:
+                portfolio.save_snapshot()
+        return closed
+
+    def on_bar(self, portfolio, date, ticker, high, low, close):
+        # a bar only moves the positions of its ticker that were already open when it started
+        date = pd.Timestamp(date)
+        selected = np.array([t == ticker and date >= entry_time(transaction_date, date.tz)
+                             for t, transaction_date in zip(portfolio.ticker, portfolio.transaction_date)],
+                            dtype=bool)
+        if not selected.any():
+            return []
+
+        highs = np.where(selected, high, np.nan)
+        lows = np.where(selected, low, np.nan)
+        best_price = np.where(portfolio.long, highs, lows)
+        worst_price = np.where(portfolio.long, lows, highs)
+
+        # levels from before this bar: within one bar the order of high and low is unknown, so a bar that
+        # reaches both the stop and the take profit is taken as a stop
+        stop_level = portfolio.stop_loss_level
+        take_profit_level = portfolio.take_profit_level
+        with np.errstate(invalid='ignore'):
+            hit_stop = selected & (portfolio.profit_loss_at(worst_price) <= stop_level)
+            evaluation = portfolio_manager.latest_evaluation.get(ticker, np.nan)
+            signal_faded = np.where(portfolio.long, evaluation <= portfolio_manager.entry_threshold,
+                                    evaluation >= -portfolio_manager.entry_threshold)
+            hit_take_profit = (selected & ~hit_stop & signal_faded &
+                               (portfolio.profit_loss_at(best_price) >= take_profit_level))
+
+        portfolio.mark_bars(highs, lows, np.where(selected, close, np.nan))
+
+        to_close = np.flatnonzero(hit_stop | hit_take_profit)
+        if len(to_close) == 0:
+            return []
+
+        actions = ['Closed (Take Profit)' if hit_take_profit[i] else 'Closed (Stop Loss)' for i in to_close]
+        fills = portfolio.price_at(np.where(hit_take_profit, take_profit_level, stop_level))[to_close]
+        for i, action, fill in zip(to_close, actions, fills):
+            position = 'Long' if portfolio.long[i] else 'Short'
+            portfolio_manager.send_telegram_message(
+                f"Position closed: {portfolio.ticker[i]} - {position} at ${fill:.5f} {action}")
+            metrics.count('positions_closed', ticker=portfolio.ticker[i], action=action, source='watcher')
+        return portfolio.close(to_close, actions, date.strftime(date_format), fills)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                if is_fx_open():
+                    self.poll()
+            except Exception as e:
+                print(f"Error in position watcher: {e}")
+            self.stop_event.wait(max(0.0, self.poll_seconds - (time.monotonic() - started)))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='position-watcher', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
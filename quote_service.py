@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pandas as pd
+
+from metrics import metrics
+
+quote_ttl = 90
+
+
+class YahooQuoteProvider:
+    def fetch(self, symbols):
+        import yfinance as yf
+
+        data = yf.download(symbols, period="1d", group_by='ticker', progress=False, threads=False)
+        prices = {}
+        for symbol in symbols:
+            try:
+                closes = data[symbol]['Close'] if isinstance(data.columns, pd.MultiIndex) else data['Close']
+                closes = closes.dropna()
+                if len(closes) > 0:
+                    prices[symbol] = float(closes.iloc[-1])
+            except KeyError:
+                continue
+        return prices
+
+
+class QuoteService:
+    # last price per yahoo symbol with the time it was obtained; stages that already downloaded bars publish
+    # their last close here, everything else missing or older than the ttl is fetched in one batch
+    def __init__(self, ttl=quote_ttl, provider=None):
+        self.ttl = ttl
+        self.provider = provider if provider is not None else YahooQuoteProvider()
+        self.quotes = {}
+        self.lock = threading.Lock()
+
+    def publish(self, symbol, price, fetched_at=None):
+        with self.lock:
+            self.quotes[symbol] = (float(price), time.monotonic() if fetched_at is None else fetched_at)
+
+    def get(self, symbols):
+        now = time.monotonic()
+        with self.lock:
+            fresh = {symbol: self.quotes[symbol][0] for symbol in symbols
+                     if symbol in self.quotes and now - self.quotes[symbol][1] <= self.ttl}
+        missing = [symbol for symbol in dict.fromkeys(symbols) if symbol not in fresh]
+        metrics.count('quote_cache_hits', len(fresh))
+
+        if missing:
+            try:
+                with metrics.timer('quote_fetch'):
+                    fetched = self.provider.fetch(missing)
+            except Exception as e:
+                print(f"Error fetching quotes for {', '.join(missing)}: {e}")
+                fetched = {}
+            for symbol, price in fetched.items():
+                self.publish(symbol, price)
+            fresh.update(fetched)
+
+        return fresh
+
+
+quotes = QuoteService()
@@ -0,0 +1,262 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+import zlib
+
+import pandas as pd
+
+from bar_cache import BASE_INTERVAL, BarCache, LocalProvider
+from benchmark import SyntheticProvider, SyntheticSentimentSource, patched
+
+# the whole signals -> evaluation -> portfolio chain on replayed bars, sentiment and quotes running
+# speed times faster than real time, myfxbook and telegram answered by local stub servers
+default_start = '2024-03-04'
+# the signals job runs once per base bar close (see scheduler), so that is a cycle's budget
+signals_minutes = int(pd.Timedelta(BASE_INTERVAL).total_seconds() // 60)
+pair_sizes = [5, 20, 80]
+speeds = [60, 300, 1200]
+cycles = 6
+
+default_parameters = {'prominence': [0.0004, 0.0008, 0.0015], 'distance': [3, 5, 16]}
+
+
+class ReplayClock:
+    # virtual utc time starting at start and running speed times faster than the wall clock
+    def __init__(self, start=default_start, speed=1.0):
+        start = pd.Timestamp(start)
+        self.start = start.tz_localize('UTC') if start.tz is None else start.tz_convert('UTC')
+        self.speed = speed
+        self.started = time.monotonic()
+
+    def now(self):
+        return self.start + pd.Timedelta(seconds=(time.monotonic() - self.started) * self.speed)
+
+    def wait_until(self, moment):
+        remaining = (moment - self.now()).total_seconds()
+        if remaining > 0:
+            time.sleep(remaining / self.speed)
+
+
+class ReplayProvider:
+    # bar provider that only hands out bars opened before the clock's now; the source is LocalProvider for
+    # recorded bars or SyntheticProvider, and the bar containing now comes whole rather than still forming
+    def __init__(self, source, clock):
+        self.source = source
+        self.clock = clock
+
+    def download(self, ticker, start_date, end_date, interval):
+        data = self.source.download(ticker, start_date, end_date, interval)
+        return data[data.index <= self.clock.now()]
+
+
+class ReplayQuoteProvider:
+    # quote_service provider: the last replayed close of every symbol
+    def __init__(self, provider, clock, interval=BASE_INTERVAL):
+        self.provider = provider
+        self.clock = clock
+        self.interval = interval
+
+    def fetch(self, symbols):
+        now = self.clock.now()
+        # far enough back to find the friday close over a weekend
+        start_date = (now - pd.Timedelta(days=4)).strftime('%Y-%m-%d')
+        end_date = (now + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        prices = {}
+        for symbol in symbols:
+            bars = self.provider.download(symbol, start_date, end_date, self.interval)
+            if len(bars) > 0:
+                prices[symbol] = float(bars['Close'].iloc[-1])
+        return prices
+
+
+class ReplaySentimentSource(SyntheticSentimentSource):
+    # synthetic overview page whose short percentages move every replayed hour
+    def __init__(self, symbols, clock):
+        super().__init__(symbols)
+        self.clock = clock
+
+    def short(self, symbol):
+        hour = int(self.clock.now().timestamp() // 3600)
+        return 40 + (zlib.crc32(symbol.encode()) + hour) % 20
+
+
+def recorded_tickers(directory, interval=BASE_INTERVAL):
+    suffix = f"_{interval}.csv"
+    return sorted(f[:-len(suffix)] for f in os.listdir(directory) if f.endswith(suffix))
+
+
+def replay_tickers(pairs, bars_directory=None):
+    if bars_directory is None:
+        return [f"SYN{i:03d}=X" for i in range(pairs)]
+    tickers = recorded_tickers(bars_directory)
+    if len(tickers) < pairs:
+        print(f"Only {len(tickers)} recorded pairs in {bars_directory}")
+    return tickers[:pairs]
+
+
+@contextlib.contextmanager
+def replayed(tickers, clock, bar_source, directory, sentiment_directory=None):
+    # points every module of the chain at the replay and keeps all files under directory; the pairs run on
+    # threads in this process, shard workers would not see the replay
+    import MACD_calculator
+    import market_hours
+    import myfxbook_scrapper
+    import portfolio_manager
+    from indicator_engine import IndicatorEngine
+    from metrics import metrics
+    from myfxbook_scrapper import FixtureSource, MyfxbookSource, SentimentProvider, StubMyfxbookServer
+    from notifier import StubTelegramServer, TelegramNotifier
+    from quote_service import QuoteService
+
+    provider = ReplayProvider(bar_source, clock)
+    symbols = [ticker.split('=')[0] for ticker in tickers]
+    page_source = (FixtureSource(sentiment_directory) if sentiment_directory is not None
+                   else ReplaySentimentSource(symbols, clock))
+    parameters = {ticker: MACD_calculator.parameters.get(ticker, default_parameters) for ticker in tickers}
+    # the caches expire on the wall clock, so their ttls shrink with the speed
+    quotes = QuoteService(ttl=60.0 / clock.speed, provider=ReplayQuoteProvider(provider, clock))
+
+    with StubMyfxbookServer(page_source) as myfxbook, StubTelegramServer() as telegram:
+        sentiment = SentimentProvider(MyfxbookSource(url=myfxbook.url),
+                                      ttl=myfxbook_scrapper.sentiment_ttl / clock.speed)
+        notifier = TelegramNotifier(telegram.url, 'replay', coalesce_window=1.0 / clock.speed,
+                                    min_interval=3.0 / clock.speed)
+        with patched(metrics, directory=os.path.join(directory, 'metrics'), profile=False), \
+                patched(market_hours, check_market_hours=False), \
+                patched(myfxbook_scrapper, sentiment=sentiment), \
+                patched(MACD_calculator, cache=BarCache(os.path.join(directory, 'bars'), provider),
+                        engine=IndicatorEngine(), ticker_memo={}, last_saved_signature=None, tickers=tickers,
+                        parameters=parameters, clock=clock.now, shards=0, quotes=quotes,
+                        state_file=os.path.join(directory, 'macd_state.json')), \
+                patched(portfolio_manager, portfolio_file=os.path.join(directory, 'portfolio.csv'),
+                        history_file=os.path.join(directory, 'transaction_history.csv'),
+                        journal_file=os.path.join(directory, 'journal.jsonl'), state=None, notifier=notifier,
+                        quotes=quotes, latest_evaluation={}, strategies_book=None,
+                        strategies_directory=os.path.join(directory, 'strategies')):
+            yield myfxbook, telegram
+        notifier.flush(10)
+
+
+def stage_seconds(cycles_file):
+    # seconds per stage summed over its labels (threads overlap, so fetch stages can add up to more than the
+    # cycle), averaged over the cycles
+    with open(cycles_file) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    totals = {}
+    for entry in entries:
+        for observation in entry['observations']:
+            if observation['name'] == 'stage_seconds' and observation['stage'] != 'cycle':
+                totals[observation['stage']] = totals.get(observation['stage'], 0.0) + observation['sum']
+    return {stage: total / len(entries) for stage, total in sorted(totals.items())} if entries else {}
+
+
+def run_replay(pairs, speed, cycles=cycles, bars_directory=None, start=None, minutes=signals_minutes,
+               sentiment_directory=None):
+    from pipeline import Pipeline
+
+    tickers = replay_tickers(pairs, bars_directory)
+    budget = minutes * 60.0 / speed
+    durations = []
+    with tempfile.TemporaryDirectory() as directory:
+        clock = ReplayClock(start or default_start, speed)
+        bar_source = LocalProvider(bars_directory) if bars_directory is not None else SyntheticProvider(clock.now)
+        with replayed(tickers, clock, bar_source, directory, sentiment_directory) as (myfxbook, telegram):
+            pipeline = Pipeline(persist=False)
+            with contextlib.redirect_stdout(io.StringIO()):
+                for cycle in range(cycles):
+                    clock.wait_until(clock.start + pd.Timedelta(minutes=minutes * cycle))
+                    started = time.perf_counter()
+                    pipeline.signals_stage()
+                    durations.append(time.perf_counter() - started)
+        stages = stage_seconds(os.path.join(directory, 'metrics', 'cycles.jsonl'))
+
+    # the first cycle downloads the whole lookback, the steady state is the cycles after it
+    warm = durations[1:] or durations
+    median = statistics.median(warm)
+    return {
+        'pairs': len(tickers),
+        'speed': speed,
+        'cycles': len(durations),
+        'budget': budget,
+        'first': durations[0],
+        'median': median,
+        'max': max(warm),
+        'load': median / budget,
+        'late': sum(duration > budget for duration in warm),
+        'pairs/s': len(tickers) / median,
+        'myfxbook requests': myfxbook.requests,
+        'telegram messages': len(telegram.messages),
+        'stages': stages
+    }
+
+
+def load_test(pair_sizes=pair_sizes, speeds=speeds, cycles=cycles, bars_directory=None, start=None,
+              minutes=signals_minutes, sentiment_directory=None):
+    # the budget of a cycle is its schedule interval in replayed time, a cycle after the first is late when it
+    # takes longer
+    rows = []
+    for pairs in pair_sizes:
+        for speed in speeds:
+            print(f"Replaying {pairs} pairs at {speed}x...")
+            rows.append(run_replay(pairs, speed, cycles, bars_directory, start, minutes, sentiment_directory))
+    summary = pd.DataFrame([{key: value for key, value in row.items() if key != 'stages'} for row in rows])
+    stages = pd.DataFrame({f"{row['pairs']}x{row['speed']}": row['stages'] for row in rows}).fillna(0.0)
+    return summary, stages
+
+
+def play(pairs, speed, bars_directory=None, start=None, minutes=signals_minutes, sentiment_directory=None):
+    from pipeline import Pipeline
+
+    tickers = replay_tickers(pairs, bars_directory)
+    with tempfile.TemporaryDirectory() as directory:
+        clock = ReplayClock(start or default_start, speed)
+        bar_source = LocalProvider(bars_directory) if bars_directory is not None else SyntheticProvider(clock.now)
+        with replayed(tickers, clock, bar_source, directory, sentiment_directory) as (myfxbook, telegram):
+            pipeline = Pipeline(persist=False)
+            cycle = 0
+            while True:
+                clock.wait_until(clock.start + pd.Timedelta(minutes=minutes * cycle))
+                print(f"Replayed time {clock.now():%Y-%m-%d %H:%M}")
+                pipeline.signals_stage()
+                cycle += 1
+
+
+def sizes(text):
+    return [int(value) for value in text.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays bars, sentiment and quotes faster than real time')
+    parser.add_argument('mode', choices=['load', 'play'], help='load: scale pairs and speed and report timings, '
+                                                               'play: run the pipeline on the replay')
+    parser.add_argument('--pairs', type=sizes, default=pair_sizes, help='comma separated pair counts')
+    parser.add_argument('--speeds', type=sizes, default=speeds, help='comma separated replay speeds')
+    parser.add_argument('--cycles', type=int, default=cycles)
+    parser.add_argument('--minutes', type=int, default=signals_minutes, help='signal schedule in replayed minutes')
+    parser.add_argument('--start', default=default_start, help='replayed time to start at (utc)')
+    parser.add_argument('--bars', help='recorded <ticker>_<interval>.csv bars, synthetic bars by default')
+    parser.add_argument('--sentiment', help='saved myfxbook pages, synthetic sentiment by default')
+    args = parser.parse_args()
+
+    if args.mode == 'play':
+        play(args.pairs[0], args.speeds[0], args.bars, args.start, args.minutes, args.sentiment)
+    else:
+        summary, stages = load_test(args.pairs, args.speeds, args.cycles, args.bars, args.start, args.minutes,
+                                    args.sentiment)
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(summary.to_string(index=False))
+            print()
+            print("Seconds per cycle by stage:")
+            print(stages.to_string())
+        late = summary[summary['late'] > 0]
+        if len(late) > 0:
+            first = late.iloc[0]
+            print(f"First configuration that does not fit its schedule: {int(first['pairs'])} pairs at "
+                  f"{int(first['speed'])}x")
+        else:
+            print("Every configuration fits its schedule")
@@ -1,11 +1,8 @@
+from portfolio_manager import update_portfolio, scheduled_update
+from position_watcher import PositionWatcher
+from scheduler import Scheduler
 
-import schedule
-import time
-from portfolio_manager import update_portfolio
-
-update_portfolio()
-schedule.every(2).minutes.do(update_portfolio)
-
-while True:
-    schedule.run_pending()
-    time.sleep(1)
\ No newline at end of file
+if __name__ == '__main__':
+    update_portfolio()
+    PositionWatcher().start()
+    Scheduler().every('2m', scheduled_update, name='portfolio').run()
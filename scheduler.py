@@ -0,0 +1,84 @@
+import threading
+import time
+from datetime import timezone
+
+import pandas as pd
+
+from market_hours import next_open
+from metrics import metrics
+
+# seconds after a bar closes before its job runs, so yahoo has the closed bar
+settle_seconds = 20
+
+
+def next_slot(now, period, settle=0.0, tz=timezone.utc):
+    # the first bar close + settle after now; closes are multiples of period since midnight in tz (the 90m fx
+    # bars start at midnight of the data timezone, the 15m and 60m ones line up in any timezone)
+    period = pd.Timedelta(period)
+    local = pd.Timestamp(now).tz_convert(tz)
+    midnight = local.normalize()
+    closes = (local - midnight - pd.Timedelta(seconds=settle)) // period + 1
+    return midnight + closes * period + pd.Timedelta(seconds=settle)
+
+
+class Scheduler:
+    # one thread per job that sleeps until its next slot: the slot is worked out on the wall clock, the wait
+    # runs on the monotonic one and is cut short by stop(); a run that outlasts its period skips the slots it
+    # missed instead of running them back to back
+    def __init__(self):
+        self.jobs = []
+        self.threads = []
+        self.stop_event = threading.Event()
+
+    def every(self, period, job, settle=0.0, name=None, tz=timezone.utc, market_hours=True):
+        # with market_hours the job sleeps through the closed FX hours instead of waking up every slot
+        self.jobs.append((pd.Timedelta(period), job, settle, name or job.__name__, tz, market_hours))
+        return self
+
+    def _loop(self, period, job, settle, name, tz, market_hours):
+        slot = None
+        while not self.stop_event.is_set():
+            now = pd.Timestamp.now(tz='UTC')
+            upcoming = next_slot(now, period, settle, tz)
+            if slot is not None:
+                # a wait that ended just before the wall clock reached slot (clock drift, an ntp step back)
+                # would find slot again and run it twice
+                upcoming = max(upcoming, slot + period)
+                skipped = int((upcoming - slot) / period) - 1
+                if skipped > 0:
+                    print(f"{name} ran past its next slot, skipping {skipped} runs")
+                    metrics.count('schedule_skipped', skipped, job=name)
+            if market_hours:
+                upcoming = next_slot(max(now, pd.Timestamp(next_open(now.to_pydatetime()))), period, settle, tz)
+            slot = upcoming
+
+            deadline = time.monotonic() + (slot - pd.Timestamp.now(tz='UTC')).total_seconds()
+            if self.stop_event.wait(max(0.0, deadline - time.monotonic())):
+                break
+            metrics.observe('schedule_lag_seconds', (pd.Timestamp.now(tz='UTC') - slot).total_seconds(), job=name)
+            try:
+                job()
+            except Exception as e:
+                print(f"Error in {name}: {e}")
+
+    def start(self):
+        for period, job, settle, name, tz, market_hours in self.jobs:
+            thread = threading.Thread(target=self._loop, args=(period, job, settle, name, tz, market_hours),
+                                      name=f"schedule-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def run(self):
+        self.start()
+        try:
+            for thread in self.threads:
+                thread.join()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
@@ -0,0 +1,88 @@
+import multiprocessing
+import time
+import zlib
+
+from metrics import metrics
+
+
+class ShardPool:
+    # one long-lived process per shard; a pair always lands on the same shard (crc32 of the ticker), so its
+    # indicator state stays in that process between cycles and in its own snapshot file between restarts
+    def __init__(self, shards, state_file=None):
+        context = multiprocessing.get_context('spawn')
+        self.connections = []
+        self.processes = []
+        self.cycle = 0
+        for shard in range(shards):
+            parent, child = context.Pipe()
+            shard_state = None if state_file is None else f"{state_file}.shard{shard}"
+            process = context.Process(target=_worker, args=(child, shard_state), name=f"macd-shard-{shard}",
+                                      daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def shard(self, ticker):
+        return zlib.crc32(ticker.encode()) % len(self.processes)
+
+    def fetch_peaks(self, tickers, start_dates, end_date, intervals, parameters, deadline):
+        self.cycle += 1
+        shards = {}
+        for ticker in tickers:
+            shards.setdefault(self.shard(ticker), []).append(ticker)
+
+        for shard, shard_tickers in shards.items():
+            self.connections[shard].send((self.cycle, shard_tickers, start_dates, end_date, intervals,
+                                          {ticker: parameters[ticker] for ticker in shard_tickers}))
+
+        peaks = {}
+        for shard in shards:
+            connection = self.connections[shard]
+            while True:
+                if not connection.poll(max(0.0, deadline - time.monotonic())):
+                    print(f"Timed out waiting for shard {shard}")
+                    break
+                cycle, result, delta = connection.recv()
+                # replies that arrive after their cycle timed out are dropped
+                if cycle != self.cycle:
+                    continue
+                # the worker's download and indicator timings go into this process's cycle
+                metrics.merge(delta)
+                if isinstance(result, Exception):
+                    print(f"Error in shard {shard}: {result}")
+                else:
+                    peaks.update(result)
+                break
+
+        return peaks
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join(timeout=5)
+
+
+def _worker(connection, shard_state):
+    import MACD_calculator
+
+    if shard_state is not None:
+        MACD_calculator.engine.restore(shard_state)
+
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+
+        cycle, tickers, start_dates, end_date, intervals, parameters = message
+        with metrics.collect() as delta:
+            try:
+                deadline = time.monotonic() + MACD_calculator.fetch_timeout
+                result = MACD_calculator.fetch_peaks(tickers, start_dates, end_date, intervals, parameters,
+                                                     deadline)
+                if shard_state is not None:
+                    with metrics.timer('state_snapshot'):
+                        MACD_calculator.engine.snapshot(shard_state)
+            except Exception as e:
+                result = e
+        connection.send((cycle, result, delta))
@@ -0,0 +1,259 @@
+import hashlib
+import os
+import re
+import sqlite3
+from datetime import datetime
+from io import StringIO
+
+import pandas as pd
+
+store_file = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\signals.db"
+
+timestamp_format = '%Y-%m-%d %H:%M:%S'
+filename_pattern = re.compile(r'^signals_(\d{8}_\d{6})\.csv$')
+
+FLOAT_COLUMNS = ['LAST PEAK PRICE', 'LAST PEAK MACD', 'RECENT PRICE', 'RECENT MACD', 'PRICE CHANGE',
+                 'PERCENTAGE CHANGE', 'SHORT %']
+DATE_COLUMNS = ['LAST PEAK DATE', 'RECENT PRICE DATE']
+
+
+class SignalStore:
+    # snapshots are typed frames in arrow ipc format (a blob in the data column); without pyarrow, and in
+    # stores migrated before imports were typed, they are csv text until convert_csv_snapshots() runs; both
+    # come back as typed frames. Timestamps carry microseconds when there are any, so two snapshots saved
+    # in the same second both stay, and sort the same as the whole second ones of the csv archives
+    def __init__(self, path=store_file):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                data TEXT NOT NULL,
+                UNIQUE (kind, timestamp)
+            );
+            CREATE INDEX IF NOT EXISTS snapshots_kind_timestamp ON snapshots (kind, timestamp);
+            CREATE TABLE IF NOT EXISTS snapshot_tickers (
+                snapshot_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                ticker TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS snapshot_tickers_kind_ticker_timestamp
+                ON snapshot_tickers (kind, ticker, timestamp);
+            CREATE TABLE IF NOT EXISTS latest (
+                kind TEXT PRIMARY KEY,
+                snapshot_id INTEGER NOT NULL,
+                timestamp TEXT NOT NULL
+            );
+        """)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def append(self, kind, df, timestamp=None):
+        # a clash with an existing snapshot raises sqlite3.IntegrityError instead of replacing it
+        timestamp = store_timestamp(timestamp or datetime.now())
+        return self._append(kind, encode_frame(df), timestamp, df['Ticker'].dropna().unique(), replace=False)
+
+    def _append(self, kind, data, timestamp, tickers, replace=True):
+        with self.connection:
+            cursor = self.connection.execute(
+                f"INSERT {'OR REPLACE ' if replace else ''}INTO snapshots (kind, timestamp, data) VALUES (?, ?, ?)",
+                (kind, timestamp, data))
+            snapshot_id = cursor.lastrowid
+            self.connection.execute('DELETE FROM snapshot_tickers WHERE kind = ? AND timestamp = ?', (kind, timestamp))
+            self.connection.executemany(
+                'INSERT INTO snapshot_tickers (snapshot_id, kind, timestamp, ticker) VALUES (?, ?, ?, ?)',
+                [(snapshot_id, kind, timestamp, str(ticker)) for ticker in tickers])
+            self.connection.execute("""
+                INSERT INTO latest (kind, snapshot_id, timestamp) VALUES (?, ?, ?)
+                ON CONFLICT (kind) DO UPDATE SET snapshot_id = excluded.snapshot_id, timestamp = excluded.timestamp
+                WHERE excluded.timestamp >= latest.timestamp
+            """, (kind, snapshot_id, timestamp))
+        return snapshot_id
+
+    def latest(self, kind):
+        row = self.connection.execute("""
+            SELECT snapshots.data FROM latest JOIN snapshots ON snapshots.id = latest.snapshot_id
+            WHERE latest.kind = ?
+        """, (kind,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"No {kind} snapshots in the store.")
+        return decode_frame(row[0])
+
+    def latest_timestamp(self, kind):
+        row = self.connection.execute('SELECT timestamp FROM latest WHERE kind = ?', (kind,)).fetchone()
+        return None if row is None else datetime.fromisoformat(row[0])
+
+    def history(self, kind, start=None, end=None, ticker=None):
+        query = 'SELECT id, timestamp, data FROM snapshots WHERE kind = ?'
+        params = [kind]
+        if ticker is not None:
+            query = """
+                SELECT snapshots.id, snapshots.timestamp, snapshots.data FROM snapshot_tickers
+                JOIN snapshots ON snapshots.id = snapshot_tickers.snapshot_id
+                WHERE snapshot_tickers.kind = ? AND snapshot_tickers.ticker = ?
+            """
+            params.append(ticker)
+            prefix = 'snapshot_tickers.'
+        else:
+            prefix = ''
+        if start is not None:
+            query += f' AND {prefix}timestamp >= ?'
+            params.append(store_timestamp(pd.Timestamp(start)))
+        if end is not None:
+            query += f' AND {prefix}timestamp < ?'
+            params.append(store_timestamp(pd.Timestamp(end)))
+        query += f' ORDER BY {prefix}timestamp'
+
+        rows = self.connection.execute(query, params).fetchall()
+        if not rows:
+            return pd.DataFrame()
+
+        if all(isinstance(data, bytes) for _, _, data in rows):
+            # arrow snapshots are joined as arrow tables and converted to pandas once
+            history = decode_tables([(pd.Timestamp(timestamp), data) for _, timestamp, data in rows])
+        else:
+            frames = []
+            for _, timestamp, data in rows:
+                frame = decode_frame(data)
+                frame.insert(0, 'Snapshot', pd.Timestamp(timestamp))
+                frames.append(frame)
+            history = pd.concat(frames, ignore_index=True)
+
+        if ticker is not None:
+            history = history[history['Ticker'] == ticker].reset_index(drop=True)
+        return history
+
+    def import_csv_directory(self, kind, directory):
+        imported = 0
+        for filename in sorted(os.listdir(directory)):
+            match = filename_pattern.match(filename)
+            if match is None:
+                continue
+            timestamp = datetime.strptime(match.group(1), '%Y%m%d_%H%M%S').strftime(timestamp_format)
+            # typed once here, so history() only has to decode arrow
+            frame = typed_signals(pd.read_csv(os.path.join(directory, filename), encoding='utf-8'))
+            self._append(kind, encode_frame(frame), timestamp, frame['Ticker'].dropna().unique())
+            imported += 1
+        return imported
+
+    def convert_csv_snapshots(self):
+        # one-off for stores that still hold csv text from an earlier import
+        rows = self.connection.execute("SELECT id, data FROM snapshots WHERE typeof(data) = 'text'").fetchall()
+        converted = [(encode_frame(decode_frame(data)), snapshot_id) for snapshot_id, data in rows]
+        converted = [(data, snapshot_id) for data, snapshot_id in converted if isinstance(data, bytes)]
+        with self.connection:
+            self.connection.executemany('UPDATE snapshots SET data = ? WHERE id = ?', converted)
+        return len(converted)
+
+
+def store_timestamp(moment):
+    text = moment.strftime(timestamp_format)
+    return f"{text}.{moment.microsecond:06d}" if moment.microsecond else text
+
+
+def encode_frame(df):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return df.to_csv(index=False)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_frame(data):
+    if isinstance(data, bytes):
+        import pyarrow as pa
+
+        return pa.ipc.open_stream(data).read_all().to_pandas()
+    return typed_signals(pd.read_csv(StringIO(data)))
+
+
+def decode_tables(snapshots):
+    import pyarrow as pa
+
+    tables = []
+    for timestamp, data in snapshots:
+        table = pa.ipc.open_stream(data).read_all()
+        tables.append(table.add_column(0, 'Snapshot', pa.array([timestamp] * table.num_rows, pa.timestamp('us'))))
+    return pa.concat_tables(tables, promote_options='permissive').to_pandas()
+
+
+def typed_signals(df):
+    # float64 and datetime columns with NaN/NaT where the old csv had 'N/A' or '46.00%' style strings
+    df = df.copy()
+    for column in FLOAT_COLUMNS:
+        if column in df and not pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column].astype(str).str.strip().str.rstrip('%'), errors='coerce')
+    for column in DATE_COLUMNS:
+        if column in df and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = to_dates(df[column])
+    return df
+
+
+def to_dates(values):
+    try:
+        return pd.to_datetime(values, errors='coerce')
+    except (ValueError, TypeError):
+        # different utc offsets in one column
+        return pd.to_datetime(values, errors='coerce', utc=True)
+
+
+def frame_signature(df):
+    # last index entry plus a hash of every value; equal signatures mean nothing downstream has to be redone
+    if len(df) == 0:
+        return (tuple(df.columns), None, None)
+    # dates hash by their resolution as well, a cache load in ns and a fresh download in us must still match
+    df = df.copy()
+    for column in df:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.as_unit('ns')
+    if isinstance(df.index, pd.DatetimeIndex):
+        df.index = df.index.as_unit('ns')
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()).hexdigest()
+    return (tuple(df.columns), df.index[-1], digest)
+
+
+def format_signals(df):
+    # the human readable layout the csv exports always had
+    df = df.copy()
+    formats = {'LAST PEAK PRICE': '{:.4f}', 'LAST PEAK MACD': '{:.7f}', 'RECENT PRICE': '{:.4f}',
+               'RECENT MACD': '{:.7f}', 'PRICE CHANGE': '{:.4f}', 'PERCENTAGE CHANGE': '{:.2f}%', 'SHORT %': '{:.2f}%'}
+    for column, text in formats.items():
+        if column in df and pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = [text.format(value) if pd.notna(value) else 'N/A' for value in df[column]]
+    for column in DATE_COLUMNS:
+        if column in df:
+            df[column] = [str(value) if pd.notna(value) else 'N/A' for value in df[column]]
+    return df
+
+
+def migrate(store, csv_directory, eval_directory):
+    signals = store.import_csv_directory('signals', csv_directory)
+    evals = store.import_csv_directory('evals', eval_directory)
+    print(f"Imported {signals} signal snapshots and {evals} evaluation snapshots into the store")
+    converted = store.convert_csv_snapshots()
+    if converted:
+        print(f"Converted {converted} csv snapshots to arrow")
+
+
+if __name__ == '__main__':
+    with SignalStore() as store:
+        migrate(store,
+                r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\csvs",
+                r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\evals")
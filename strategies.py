@@ -0,0 +1,309 @@
+import itertools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from portfolio_state import date_format, history_columns, portfolio_columns
+
+strategies_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'strategies.csv')
+strategies_directory = r"C:\Users\2001s\PycharmProjects\Jak poznać ślicznotkę życia\strategies"
+
+STRATEGY_COLUMNS = ['Initial Value', 'Investment', 'Entry Threshold', 'Take Profit', 'Stop Loss', 'Leverage']
+summary_columns = ['Name'] + STRATEGY_COLUMNS + ['Portfolio Value', 'Return %', 'Realized', 'Open Profit/Loss',
+                                                 'Open Positions', 'Trades', 'Win Rate', 'Average Trade',
+                                                 'Profit Factor', 'Max Drawdown %']
+
+
+def _attribute(column):
+    return column.lower().replace(' ', '_')
+
+
+def load_strategies(path=strategies_file):
+    # one row per portfolio configuration: Name, the STRATEGY_COLUMNS and an optional Enabled column
+    table = pd.read_csv(path)
+    if 'Enabled' in table:
+        table = table[table['Enabled'].fillna(1).astype(bool)]
+    return table.reset_index(drop=True)
+
+
+def strategy_grid(base, **values):
+    # every combination of the given settings (keyword per column, e.g. take_profit=[0.2, 0.27]) on top of
+    # base, named after the settings that vary
+    keywords = {_attribute(column): column for column in STRATEGY_COLUMNS}
+    unknown = [keyword for keyword in values if keyword not in keywords]
+    if unknown:
+        raise ValueError(f"Unknown strategy settings: {', '.join(unknown)}")
+
+    rows = []
+    for combination in itertools.product(*values.values()):
+        row = {column: base[column] for column in STRATEGY_COLUMNS}
+        row.update({keywords[keyword]: value for keyword, value in zip(values, combination)})
+        row['Name'] = '_'.join(f"{keyword}={value:g}" for keyword, value in zip(values, combination)) or 'base'
+        rows.append(row)
+    return pd.DataFrame(rows, columns=['Name'] + STRATEGY_COLUMNS)
+
+
+class StrategyBook:
+    # many portfolio configurations run side by side on the same evaluations and prices: positions are
+    # strategies x tickers arrays (one position per ticker and strategy, as in update_portfolio) and every
+    # setting is a strategies x 1 column, so one tick opens, marks and closes for all of them at once
+    def __init__(self, strategies, keep_equity=False):
+        self.strategies = strategies.reset_index(drop=True)
+        self.names = list(self.strategies['Name'])
+        for column in STRATEGY_COLUMNS:
+            setattr(self, _attribute(column), self.strategies[column].to_numpy(dtype='float64')[:, None])
+
+        count = len(self.names)
+        self.tickers = []
+        self.held = np.zeros((count, 0), dtype=bool)
+        self.long = np.zeros((count, 0), dtype=bool)
+        self.entry = np.zeros((count, 0))
+        self.current = np.zeros((count, 0))
+        self.profit_loss = np.zeros((count, 0))
+        self.min_profit_loss = np.zeros((count, 0))
+        self.max_profit_loss = np.zeros((count, 0))
+        self.opened_at = np.empty((count, 0), dtype=object)
+
+        self.realized = np.zeros(count)
+        self.trades = np.zeros(count, dtype=int)
+        self.wins = np.zeros(count, dtype=int)
+        self.gross_profit = np.zeros(count)
+        self.gross_loss = np.zeros(count)
+        self.peak_value = self.initial_value[:, 0].copy()
+        self.max_drawdown = np.zeros(count)
+        self.value = self.initial_value[:, 0].copy()
+
+        self.history = [[] for _ in self.names]
+        self.pending = [[] for _ in self.names]
+        self.keep_equity = keep_equity
+        self.equity = []
+
+    def add_tickers(self, tickers):
+        # tickers seen for the first time get a column of empty slots
+        new = [ticker for ticker in dict.fromkeys(tickers) if ticker not in self.tickers]
+        if new:
+            pad = ((0, 0), (0, len(new)))
+            for name, fill in [('held', False), ('long', False), ('entry', np.nan), ('current', np.nan),
+                               ('profit_loss', 0.0), ('min_profit_loss', 0.0), ('max_profit_loss', 0.0),
+                               ('opened_at', None)]:
+                setattr(self, name, np.pad(getattr(self, name), pad, constant_values=fill))
+            self.tickers.extend(new)
+
+    def held_tickers(self):
+        return [self.tickers[i] for i in np.flatnonzero(self.held.any(axis=0))]
+
+    def monetary(self):
+        return self.investment * self.profit_loss * self.leverage / 100
+
+    def tick(self, date, evaluation, transaction_price, prices):
+        # evaluation and transaction_price: Total Evaluation and entry price per ticker of this cycle,
+        # prices: current price per ticker; a held ticker without a price keeps its last one
+        self.add_tickers(list(evaluation.keys()) + list(prices.keys()))
+        return self.step(pd.Timestamp(date),
+                         pd.Series(evaluation, dtype='float64').reindex(self.tickers).to_numpy(),
+                         pd.Series(transaction_price, dtype='float64').reindex(self.tickers).to_numpy(),
+                         pd.Series(prices, dtype='float64').reindex(self.tickers).to_numpy())
+
+    def step(self, date, evaluation, transaction_price, price):
+        # tick on arrays already aligned with self.tickers, for callers that hold matrices (the backtest)
+        held = self.held
+
+        self.current = np.where(held & ~np.isnan(price), price, self.current)
+        # min/max are taken from the previous tick's P/L before it is recomputed, as in update_portfolio
+        self.min_profit_loss = np.where(held, np.minimum(self.min_profit_loss, self.profit_loss), self.min_profit_loss)
+        self.max_profit_loss = np.where(held, np.maximum(self.max_profit_loss, self.profit_loss), self.max_profit_loss)
+        with np.errstate(invalid='ignore'):
+            move = (self.current - self.entry) / self.entry * 100
+        self.profit_loss = np.where(held, np.where(self.long, move, -move), 0.0)
+        monetary = self.monetary()
+
+        stop = self.stop_loss + self.max_profit_loss
+        take = self.take_profit + self.min_profit_loss
+
+        total_value = self.initial_value[:, 0] + np.where(held, monetary, 0.0).sum(axis=1) + self.realized
+        available = total_value - self.investment[:, 0] * held.sum(axis=1)
+
+        with np.errstate(invalid='ignore'):
+            go_long = evaluation > self.entry_threshold
+            go_short = evaluation < -self.entry_threshold
+        candidates = ~held & (go_long | go_short) & ~np.isnan(transaction_price)
+        slots = np.where(available >= self.investment[:, 0], np.floor(available / self.investment[:, 0]), 0)
+        opens = candidates & (np.cumsum(candidates, axis=1) <= slots[:, None])
+
+        held = held | opens
+        self.long = np.where(opens, go_long, self.long)
+        self.entry = np.where(opens, transaction_price, self.entry)
+        self.current = np.where(opens, transaction_price, self.current)
+        self.profit_loss = np.where(opens, 0.0, self.profit_loss)
+        monetary = np.where(opens, 0.0, monetary)
+        self.min_profit_loss = np.where(opens, 0.0, self.min_profit_loss)
+        self.max_profit_loss = np.where(opens, 0.0, self.max_profit_loss)
+        take = np.where(opens, self.take_profit, take)
+        stop = np.where(opens, self.stop_loss, stop)
+        self.opened_at[opens] = date
+
+        with np.errstate(invalid='ignore'):
+            at_take = held & (self.profit_loss >= take)
+            signal_faded = np.where(self.long, evaluation <= self.entry_threshold, evaluation >= -self.entry_threshold)
+            close_take = at_take & signal_faded
+            close_stop = held & ~at_take & (self.profit_loss <= stop)
+        closes = close_take | close_stop
+
+        for s, i in zip(*np.nonzero(closes)):
+            entry = {
+                'Transaction Date': self.opened_at[s, i].strftime(date_format),
+                'Close Date': date.strftime(date_format),
+                'Ticker': self.tickers[i],
+                'Open @ Price': self.entry[s, i],
+                'Investment Amount': self.investment[s, 0],
+                'Position': 'Long' if self.long[s, i] else 'Short',
+                'Closed @ Price': self.current[s, i],
+                'Profit/Loss': self.profit_loss[s, i],
+                'Monetary Gain/Loss': monetary[s, i],
+                'Min Profit/Loss': self.min_profit_loss[s, i],
+                'Max Profit/Loss': self.max_profit_loss[s, i],
+                'Action': 'Closed (Take Profit)' if close_take[s, i] else 'Closed (Stop Loss)'
+            }
+            self.history[s].append(entry)
+            self.pending[s].append(entry)
+
+        closed_monetary = np.where(closes, monetary, 0.0)
+        self.realized += closed_monetary.sum(axis=1)
+        self.trades += closes.sum(axis=1)
+        self.wins += (closes & (monetary > 0)).sum(axis=1)
+        self.gross_profit += np.where(closed_monetary > 0, closed_monetary, 0.0).sum(axis=1)
+        self.gross_loss -= np.where(closed_monetary < 0, closed_monetary, 0.0).sum(axis=1)
+
+        self.held = held & ~closes
+        self.profit_loss = np.where(self.held, self.profit_loss, 0.0)
+        self.min_profit_loss = np.where(self.held, self.min_profit_loss, 0.0)
+        self.max_profit_loss = np.where(self.held, self.max_profit_loss, 0.0)
+
+        self.value = total_value
+        self.peak_value = np.maximum(self.peak_value, total_value)
+        self.max_drawdown = np.maximum(self.max_drawdown, (self.peak_value - total_value) / self.peak_value * 100)
+        if self.keep_equity:
+            self.equity.append((date, total_value, self.held.sum(axis=1), self.realized.copy()))
+        return closes
+
+    def history_frame(self, strategy):
+        return pd.DataFrame(self.history[self.names.index(strategy)], columns=history_columns)
+
+    def portfolio_frame(self, strategy):
+        s = self.names.index(strategy)
+        held = np.flatnonzero(self.held[s])
+        monetary = self.monetary()[s]
+        return pd.DataFrame([{
+            'Timestamp': self.opened_at[s, i].strftime(date_format),
+            'Ticker': self.tickers[i],
+            'Transaction Date': self.opened_at[s, i].strftime(date_format),
+            'Transaction Price': self.entry[s, i],
+            'Investment Amount': self.investment[s, 0],
+            'Position': 'Long' if self.long[s, i] else 'Short',
+            'Current Price': self.current[s, i],
+            'Profit/Loss': self.profit_loss[s, i],
+            'Monetary Gain/Loss': monetary[i],
+            'Take Profit': self.take_profit[s, 0] + self.min_profit_loss[s, i],
+            'Stop Loss': self.stop_loss[s, 0] + self.max_profit_loss[s, i],
+            'Min Profit/Loss': self.min_profit_loss[s, i],
+            'Max Profit/Loss': self.max_profit_loss[s, i]
+        } for i in held], columns=portfolio_columns)
+
+    def equity_frame(self, column='Portfolio Value'):
+        # one column per strategy; column is Portfolio Value, Open Positions or Realized Gain/Loss
+        position = {'Portfolio Value': 1, 'Open Positions': 2, 'Realized Gain/Loss': 3}[column]
+        if not self.equity:
+            return pd.DataFrame(columns=self.names)
+        return pd.DataFrame([entry[position] for entry in self.equity], columns=self.names,
+                            index=pd.DatetimeIndex([entry[0] for entry in self.equity], name='Timestamp'))
+
+    def summary(self):
+        open_profit_loss = np.where(self.held, self.monetary(), 0.0).sum(axis=1)
+        value = self.initial_value[:, 0] + self.realized + open_profit_loss
+        with np.errstate(invalid='ignore', divide='ignore'):
+            summary = pd.DataFrame({
+                'Portfolio Value': value,
+                'Return %': (value / self.initial_value[:, 0] - 1) * 100,
+                'Realized': self.realized,
+                'Open Profit/Loss': open_profit_loss,
+                'Open Positions': self.held.sum(axis=1),
+                'Trades': self.trades,
+                'Win Rate': np.where(self.trades > 0, self.wins / self.trades, np.nan),
+                'Average Trade': np.where(self.trades > 0, self.realized / self.trades, np.nan),
+                'Profit Factor': np.where(self.gross_loss > 0, self.gross_profit / self.gross_loss, np.nan),
+                'Max Drawdown %': self.max_drawdown
+            })
+        return pd.concat([self.strategies[['Name'] + STRATEGY_COLUMNS], summary], axis=1)[summary_columns]
+
+    def save(self, directory=strategies_directory):
+        # <directory>/<name>/transaction_history.csv gets the closes since the last save, summary.csv and
+        # state.json are rewritten
+        for name, pending in zip(self.names, self.pending):
+            if not pending:
+                continue
+            path = os.path.join(directory, name, 'transaction_history.csv')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            pd.DataFrame(pending, columns=history_columns).to_csv(path, mode='a', index=False,
+                                                                   header=not os.path.exists(path))
+            pending.clear()
+
+        os.makedirs(directory, exist_ok=True)
+        tmp_file = os.path.join(directory, 'summary.csv.tmp')
+        self.summary().to_csv(tmp_file, index=False)
+        os.replace(tmp_file, os.path.join(directory, 'summary.csv'))
+
+        tmp_file = os.path.join(directory, 'state.json.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_file, os.path.join(directory, 'state.json'))
+
+    def to_dict(self):
+        opened_at = [[None if date is None else date.isoformat() for date in row] for row in self.opened_at]
+        return {
+            'names': self.names,
+            'tickers': self.tickers,
+            'held': self.held.tolist(),
+            'long': self.long.tolist(),
+            'entry': np.where(np.isnan(self.entry), None, self.entry).tolist(),
+            'current': np.where(np.isnan(self.current), None, self.current).tolist(),
+            'profit_loss': self.profit_loss.tolist(),
+            'min_profit_loss': self.min_profit_loss.tolist(),
+            'max_profit_loss': self.max_profit_loss.tolist(),
+            'opened_at': opened_at,
+            'realized': self.realized.tolist(),
+            'trades': self.trades.tolist(),
+            'wins': self.wins.tolist(),
+            'gross_profit': self.gross_profit.tolist(),
+            'gross_loss': self.gross_loss.tolist(),
+            'peak_value': self.peak_value.tolist(),
+            'max_drawdown': self.max_drawdown.tolist()
+        }
+
+    @classmethod
+    def load(cls, strategies, directory=strategies_directory):
+        # strategies already in state.json continue where they were, new ones start empty and removed ones
+        # are dropped
+        book = cls(strategies)
+        path = os.path.join(directory, 'state.json')
+        if not os.path.exists(path):
+            return book
+
+        with open(path) as f:
+            data = json.load(f)
+        book.add_tickers(data['tickers'])
+        rows = [(s, data['names'].index(name)) for s, name in enumerate(book.names) if name in data['names']]
+        if not rows:
+            return book
+        targets, sources = [list(side) for side in zip(*rows)]
+        for name in ['held', 'long', 'entry', 'current', 'profit_loss', 'min_profit_loss', 'max_profit_loss']:
+            values = np.array(data[name], dtype='float64' if name not in ['held', 'long'] else bool)
+            getattr(book, name)[targets] = values[sources]
+        book.opened_at[targets] = np.array([[None if date is None else pd.Timestamp(date) for date in row]
+                                            for row in data['opened_at']], dtype=object)[sources]
+        for name in ['realized', 'trades', 'wins', 'gross_profit', 'gross_loss', 'peak_value', 'max_drawdown']:
+            getattr(book, name)[targets] = np.array(data[name])[sources]
+        book.value = book.summary()['Portfolio Value'].to_numpy()
+        return book
+
@@ -0,0 +1,148 @@
+import itertools
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from scipy.signal import find_peaks
+
+from evaluation import thresholds, interval_scoring, default_price_threshold, default_macd_threshold, score_macd_price
+
+prominence_multipliers = [0.5, 0.75, 1.0, 1.5, 2.0]
+distances = [3, 5, 8, 12, 16]
+price_threshold_multipliers = [0.5, 1.0, 2.0]
+macd_threshold_multipliers = [0.5, 1.0, 2.0]
+horizon = 4
+# days of bars make_df looks back over per interval, peaks are only searched for inside that window
+window_days = {'15m': 3, '60m': 10, '90m': 20}
+
+
+def macd_histogram(close_prices):
+    ema_12 = close_prices.ewm(span=12, adjust=False).mean()
+    ema_26 = close_prices.ewm(span=26, adjust=False).mean()
+    macd_line = ema_12 - ema_26
+    signal_line = macd_line.ewm(span=9, adjust=False).mean()
+    return (macd_line - signal_line).to_numpy()
+
+
+def window_starts(index, days):
+    # first bar of the live window of every bar: make_df starts it at midnight days before now
+    starts = (index - pd.Timedelta(days=days)).normalize()
+    return index.searchsorted(starts)
+
+
+def causal_peaks(close, starts, prominence, distance):
+    # the most recent peak make_df would have found at every bar (-1 for none): find_peaks over that bar's
+    # window only, so no bar after it is ever seen (the same peaks PeakTracker gives live, without its
+    # backward scan over the window's unprominent peaks at every bar)
+    last_peak = np.full(len(close), -1)
+    for bar in range(len(close)):
+        peaks = find_peaks(close[starts[bar]:bar + 1], prominence=prominence, distance=distance)[0]
+        if len(peaks):
+            last_peak[bar] = starts[bar] + peaks[-1]
+    return last_peak
+
+
+def score_series(close, histogram, last_peak, price_threshold, macd_threshold, min_points, max_points):
+    # every bar is scored against its last causally found peak like make_df + evaluation do live
+    valid = last_peak >= 0
+    peak_index = np.where(valid, last_peak, 0)
+
+    score = score_macd_price(close[peak_index], close, histogram[peak_index], histogram,
+                             price_threshold, macd_threshold, min_points, max_points)
+    return np.where(valid, score, np.nan)
+
+
+def information_coefficient(score, forward_return):
+    valid = ~np.isnan(score) & ~np.isnan(forward_return)
+    if valid.sum() < 3 or np.std(score[valid]) == 0 or np.std(forward_return[valid]) == 0:
+        return np.nan, int(valid.sum())
+    return float(np.corrcoef(score[valid], forward_return[valid])[0, 1]), int(valid.sum())
+
+
+def sweep_series(ticker, interval, close_prices, combinations, days=None):
+    # the indicator series and each prominence/distance's peaks are computed once here and shared by every
+    # parameter combination
+    close = close_prices.to_numpy(dtype='float64')
+    histogram = macd_histogram(close_prices)
+    forward_return = np.full(len(close), np.nan)
+    forward_return[:-horizon] = close[horizon:] / close[:-horizon] - 1
+
+    min_points, max_points = interval_scoring.get(interval, (0, 0))
+    starts = window_starts(close_prices.index, days or window_days.get(interval, window_days['15m']))
+
+    peaks_cache = {}
+    results = []
+    for prominence, distance, price_threshold, macd_threshold in combinations:
+        if (prominence, distance) not in peaks_cache:
+            peaks_cache[(prominence, distance)] = causal_peaks(close, starts, prominence, distance)
+        last_peak = peaks_cache[(prominence, distance)]
+
+        score = score_series(close, histogram, last_peak, price_threshold, macd_threshold, min_points, max_points)
+        ic, samples = information_coefficient(score, forward_return)
+        results.append({
+            'Ticker': ticker,
+            'Interval': interval,
+            'prominence': prominence,
+            'distance': distance,
+            'price threshold': price_threshold,
+            'macd threshold': macd_threshold,
+            'peaks': len(np.unique(last_peak[last_peak >= 0])),
+            'samples': samples,
+            'IC': ic
+        })
+    return results
+
+
+def parameter_grid(ticker, interval_index, interval, parameters, samples=None, seed=None):
+    ticker_name = ticker.split('=')[0]
+    base_prominence = parameters[ticker]['prominence'][interval_index]
+    base_price = thresholds.get(ticker_name, {}).get('price', {}).get(interval, default_price_threshold)
+    base_macd = thresholds.get(ticker_name, {}).get('macd', {}).get(interval, default_macd_threshold)
+
+    grid = list(itertools.product(
+        [base_prominence * m for m in prominence_multipliers],
+        distances,
+        [base_price * m for m in price_threshold_multipliers],
+        [base_macd * m for m in macd_threshold_multipliers]
+    ))
+    if samples is not None and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    return grid
+
+
+def run_sweep(cache, tickers, intervals, parameters, days=60, samples=None, seed=None, max_workers=None,
+              lookback_days=None):
+    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    end_date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for ticker in tickers:
+            # resampled from one base-interval download, the same bars the live signals see
+            frames = cache.get_timeframes(ticker, [start_date] * len(intervals), end_date, intervals)
+            for i, interval in enumerate(intervals):
+                close_prices = frames[interval]['Close']
+                if len(close_prices) <= horizon:
+                    print(f"Not enough bars for {ticker} {interval}")
+                    continue
+                grid = parameter_grid(ticker, i, interval, parameters, samples, seed)
+                futures.append(executor.submit(sweep_series, ticker.split('=')[0], interval, close_prices, grid,
+                                               lookback_days[i] if lookback_days else None))
+
+        results = [row for future in futures for row in future.result()]
+
+    return pd.DataFrame(results)
+
+
+def best_parameters(results):
+    ranked = results.dropna(subset=['IC']).sort_values('IC', ascending=False)
+    return ranked.groupby(['Ticker', 'Interval'], sort=False).head(1).sort_values(['Ticker', 'Interval'])
+
+
+if __name__ == '__main__':
+    from MACD_calculator import cache, tickers, intervals, parameters, lookback_days
+
+    results = run_sweep(cache, tickers, intervals, parameters, lookback_days=lookback_days)
+    print(best_parameters(results).to_string(index=False))
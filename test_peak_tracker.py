@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from scipy.signal import find_peaks
+
+from peak_tracker import PeakTracker
+
+
+def fx_closes(seed, length, decimals):
+    # a random walk rounded like fx quotes, so equal heights within distance of each other are common
+    rng = np.random.default_rng(seed)
+    return np.round(1.1 + np.cumsum(rng.normal(0, 0.0003, length)), decimals)
+
+
+def expected(values, start, prominence, distance, n):
+    peaks = find_peaks(values[start:], prominence=prominence, distance=distance)[0] + start
+    return list(peaks[-n:]) if n else []
+
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('decimals', [3, 4, 5])
+def test_recent_peaks_match_find_peaks(seed, decimals):
+    closes = fx_closes(seed, 600, decimals)
+    for prominence, distance in [(0.0005, 3), (0.001, 5), (0.002, 16)]:
+        tracker = PeakTracker(prominence, distance)
+        for bar, close in enumerate(closes):
+            tracker.append(close)
+            if bar % 7:
+                continue
+            start = max(0, bar - 300)
+            n = 4
+            assert tracker.recent_peaks(n, start) == expected(closes[:bar + 1], start, prominence, distance, n)
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_recent_peaks_with_a_forming_bar_match_find_peaks(seed):
+    closes = fx_closes(seed, 400, 4)
+    tracker = PeakTracker(0.001, 5)
+    for bar, close in enumerate(closes[:-1]):
+        tracker.append(close)
+        forming = closes[bar + 1]
+        start = max(0, bar - 200)
+        assert tracker.recent_peaks(3, start, forming) == expected(closes[:bar + 2], start, 0.001, 5, 3)
+
+
+def test_equal_peaks_within_distance():
+    # two tops of the same height three bars apart, find_peaks keeps one of them by its own ordering
+    values = np.array([1.0, 1.2, 1.5, 1.2, 1.1, 1.5, 1.2, 1.0, 1.3, 1.0, 1.5, 0.9])
+    for distance in [2, 4, 6, 9]:
+        tracker = PeakTracker(0.1, distance)
+        for value in values:
+            tracker.append(value)
+        assert tracker.recent_peaks(5) == expected(values, 0, 0.1, distance, 5)
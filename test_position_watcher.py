@@ -0,0 +1,61 @@
+import pandas as pd
+
+import portfolio_manager
+from benchmark import patched
+from portfolio_state import PortfolioState
+from position_watcher import PositionWatcher, ReplayFeed
+
+
+class Notifier:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+
+def write_bars(directory, rows):
+    # one EURUSD 1m bar per (time, high, low, close), in the LocalProvider layout ReplayFeed reads
+    frame = pd.DataFrame([{'Datetime': pd.Timestamp(date), 'Open': close, 'High': high, 'Low': low, 'Close': close}
+                          for date, high, low, close in rows]).set_index('Datetime')
+    frame.to_csv(directory / 'EURUSD=X_1m.csv')
+
+
+def open_long(directory):
+    state = PortfolioState(str(directory / 'journal.jsonl'), str(directory / 'portfolio.csv'),
+                           str(directory / 'transaction_history.csv'), portfolio_manager.take_profit,
+                           portfolio_manager.stop_loss, portfolio_manager.leverage)
+    state.open('EURUSD', 1.1000, 'Long', 100.0, '2026-10-16 12:00:00')
+    return state
+
+
+def test_bars_before_the_entry_do_not_close_the_position(tmp_path):
+    # the morning low is far below the stop, but the position was only opened at noon
+    write_bars(tmp_path, [('2026-10-16 08:00', 1.1000, 1.0950, 1.0960),
+                          ('2026-10-16 12:00', 1.1002, 1.0999, 1.1001),
+                          ('2026-10-16 12:01', 1.1003, 1.1000, 1.1002)])
+    state = open_long(tmp_path)
+
+    with patched(portfolio_manager, state=state, notifier=Notifier(), latest_evaluation={}):
+        watcher = PositionWatcher(ReplayFeed(str(tmp_path), bars_per_poll=1), poll_seconds=0)
+        closed = watcher.poll() + watcher.poll() + watcher.poll()
+
+    assert closed == []
+    assert state.ticker == ['EURUSD']
+    # the 12:00 low of 1.0999 counts, the 08:00 low of 1.0950 (-0.45%) does not
+    assert state.min_profit_loss[0] > -0.05
+    assert not (tmp_path / 'transaction_history.csv').exists()
+
+
+def test_on_bar_skips_positions_opened_after_the_bar(tmp_path):
+    state = open_long(tmp_path)
+
+    with patched(portfolio_manager, state=state, notifier=Notifier(), latest_evaluation={}):
+        watcher = PositionWatcher(ReplayFeed(str(tmp_path)), poll_seconds=0)
+        assert watcher.on_bar(state, '2026-10-16 08:00', 'EURUSD', 1.1000, 1.0950, 1.0960) == []
+        assert state.min_profit_loss[0] == 0
+
+        closed = watcher.on_bar(state, '2026-10-16 12:05', 'EURUSD', 1.1000, 1.0950, 1.0960)
+
+    assert [entry['Action'] for entry in closed] == ['Closed (Stop Loss)']
+    assert closed[0]['Close Date'] >= closed[0]['Transaction Date']